@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Compare flatten_multidict with the former list-based implementation.
+
+Flattens batches of submission-form-like ``MultiDict`` instances and plain
+dictionaries of lists and writes a JSON report::
+
+    python benchmarks/bench_multidict.py --output multidict.json
+"""
+
+import random
+import string
+
+from werkzeug.datastructures import MultiDict
+
+from helpers import argument_parser, best_of, log, peak_memory, \
+    write_report
+from invenio_utils.datastructures import flatten_multidict
+
+
+def legacy_flatten_multidict(multidict):
+    """Former implementation building an intermediate list of tuples."""
+    lists = getattr(multidict, 'iterlists', None) or multidict.lists
+    return dict([(key, value if len(value) > 1 else value[0])
+                 for (key, value) in lists()])
+
+
+def form_fields(count=500, seed=42):
+    """Return lists of ``(field, value)`` pairs of submitted forms."""
+    rnd = random.Random(seed)
+
+    def word():
+        return u''.join(rnd.choice(string.ascii_lowercase)
+                        for dummy in range(rnd.randint(2, 12)))
+
+    forms = []
+    for dummy in range(count):
+        fields = [(u'title', word()), (u'abstract', word()),
+                  (u'csrf_token', word())]
+        fields.extend((u'authors-%d-name' % index, word())
+                      for index in range(rnd.randint(1, 20)))
+        fields.extend((u'keywords', word())
+                      for dummy in range(rnd.randint(1, 10)))
+        forms.append(fields)
+    return forms
+
+
+def dict_of_lists(fields):
+    """Return a plain dictionary of lists built from form ``fields``."""
+    result = {}
+    for key, value in fields:
+        result.setdefault(key, []).append(value)
+    return result
+
+
+def run(repeat=5):
+    """Run the benchmark and return the list of results."""
+    forms = form_fields()
+    payloads = {
+        'MultiDict': [MultiDict(fields) for fields in forms],
+        'dict_of_lists': [dict_of_lists(fields) for fields in forms],
+    }
+    implementations = {
+        'legacy': legacy_flatten_multidict,
+        'flatten_multidict': flatten_multidict,
+    }
+    results = []
+    for payload_name, batch in sorted(payloads.items()):
+        for name, function in sorted(implementations.items()):
+            if payload_name == 'dict_of_lists' and name == 'legacy':
+                # The former implementation needs ``lists()``.
+                continue
+            log('{0} / {1}'.format(payload_name, name))
+
+            def flatten_batch():
+                for multidict in batch:
+                    function(multidict)
+
+            seconds = best_of(flatten_batch, repeat)
+            results.append({
+                'payload': payload_name,
+                'implementation': name,
+                'forms': len(batch),
+                'seconds': seconds,
+                'forms_per_second': len(batch) / seconds,
+                'peak_memory': peak_memory(flatten_batch),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    args = argument_parser(__doc__.splitlines()[0]).parse_args()
+    write_report('multidict', run(args.repeat), args.output)
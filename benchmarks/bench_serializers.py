@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Compare serializers on realistic record payloads.
+
+Measures dumps/loads throughput, peak memory and compressed size of every
+serializer in :mod:`invenio_utils.serializers` and writes a JSON report::
+
+    python benchmarks/bench_serializers.py --output serializers.json
+"""
+
+import random
+import string
+
+from six.moves import cPickle as pickle
+
+from helpers import argument_parser, best_of, log, peak_memory, \
+    write_report
+from invenio_utils.serializers import LzmaPickle, Serializer, ZlibMarshal, \
+    ZlibPickle
+
+
+def _words(rnd, count):
+    return u' '.join(
+        u''.join(rnd.choice(string.ascii_lowercase)
+                 for dummy in range(rnd.randint(2, 10)))
+        for dummy in range(count))
+
+
+def marc_records(count=200, seed=42):
+    """Return MARC-like record dictionaries."""
+    rnd = random.Random(seed)
+    return [{
+        '001': [str(recid)],
+        '035__': [{'9': u'arXiv', 'a': u'oai:arXiv.org:%d' % recid}],
+        '100__': [{'a': u'%s, %s.' % (_words(rnd, 1).title(),
+                                      rnd.choice(string.ascii_uppercase)),
+                   'u': _words(rnd, 3)}],
+        '245__': [{'a': _words(rnd, 12)}],
+        '520__': [{'a': _words(rnd, 150)}],
+        '700__': [{'a': _words(rnd, 2).title(), 'u': _words(rnd, 3)}
+                  for dummy in range(rnd.randint(1, 30))],
+        '980__': [{'a': u'HEP'}, {'a': u'Citeable'}],
+    } for recid in range(count)]
+
+
+def citation_lists(count=200, seed=42):
+    """Return lists of cited record identifiers."""
+    rnd = random.Random(seed)
+    return dict((recid, [rnd.randint(1, 10 ** 6)
+                         for dummy in range(rnd.randint(0, 500))])
+                for recid in range(count))
+
+
+def large_string(size=2 * 1024 * 1024, seed=42):
+    """Return a large text blob, e.g. a fulltext."""
+    text = _words(random.Random(seed), size // 6)
+    return text[:size]
+
+
+PAYLOADS = {
+    'marc_records': marc_records,
+    'citation_lists': citation_lists,
+    'large_string': large_string,
+}
+
+SERIALIZERS = {
+    'ZlibMarshal': ZlibMarshal,
+    'ZlibPickle': ZlibPickle,
+    'LzmaPickle': LzmaPickle,
+    'marshal+none': Serializer('marshal', 'none'),
+    'pickle+zlib:1': Serializer('pickle', 'zlib', level=1),
+    'pickle+bz2': Serializer('pickle', 'bz2'),
+    'json+zlib': Serializer('json', 'zlib'),
+}
+
+
+def run(repeat=5):
+    """Run the benchmark and return the list of results."""
+    results = []
+    for payload_name, factory in sorted(PAYLOADS.items()):
+        payload = factory()
+        raw_size = len(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+        for name, serializer in sorted(SERIALIZERS.items()):
+            log('{0} / {1}'.format(payload_name, name))
+            blob = serializer.dumps(payload)
+            dumps_time = best_of(lambda: serializer.dumps(payload), repeat)
+            loads_time = best_of(lambda: serializer.loads(blob), repeat)
+            results.append({
+                'payload': payload_name,
+                'serializer': name,
+                'raw_size': raw_size,
+                'compressed_size': len(blob),
+                'ratio': float(raw_size) / len(blob),
+                'dumps_seconds': dumps_time,
+                'loads_seconds': loads_time,
+                'dumps_mb_per_second': raw_size / dumps_time / 2 ** 20,
+                'loads_mb_per_second': raw_size / loads_time / 2 ** 20,
+                'dumps_peak_memory': peak_memory(
+                    lambda: serializer.dumps(payload)),
+                'loads_peak_memory': peak_memory(
+                    lambda: serializer.loads(blob)),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    args = argument_parser(__doc__.splitlines()[0]).parse_args()
+    write_report('serializers', run(args.repeat), args.output)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Compare text normalisation functions with their former implementations.
+
+Runs accent stripping, ASCII transliteration and slug generation over
+author names and titles and writes a JSON report::
+
+    python benchmarks/bench_text.py --output text.json
+"""
+
+import random
+
+from unidecode import unidecode
+
+from helpers import argument_parser, best_of, log, write_report
+from invenio_utils import text
+from invenio_utils.text import decode_to_unicode, slugify, strip_accents, \
+    translate_to_ascii
+
+
+def legacy_strip_accents(x):
+    """Former implementation with one substitution per letter group."""
+    for regexp, replacement in [
+            (text.re_latex_lowercase_a, "a"),
+            (text.re_latex_lowercase_ae, "ae"),
+            (text.re_latex_lowercase_oe, "oe"),
+            (text.re_latex_lowercase_e, "e"),
+            (text.re_latex_lowercase_i, "i"),
+            (text.re_latex_lowercase_o, "o"),
+            (text.re_latex_lowercase_u, "u"),
+            (text.re_latex_lowercase_y, "x"),
+            (text.re_latex_lowercase_c, "c"),
+            (text.re_latex_lowercase_n, "n"),
+            (text.re_latex_uppercase_a, "A"),
+            (text.re_latex_uppercase_ae, "AE"),
+            (text.re_latex_uppercase_oe, "OE"),
+            (text.re_latex_uppercase_e, "E"),
+            (text.re_latex_uppercase_i, "I"),
+            (text.re_latex_uppercase_o, "O"),
+            (text.re_latex_uppercase_u, "U"),
+            (text.re_latex_uppercase_y, "Y"),
+            (text.re_latex_uppercase_c, "C"),
+            (text.re_latex_uppercase_n, "N")]:
+        x = regexp.sub(replacement, x)
+    try:
+        y = unicode(x, "utf-8")
+    except Exception:
+        return x
+    for regexp, replacement in [
+            (text.re_unicode_lowercase_a, "a"),
+            (text.re_unicode_lowercase_ae, "ae"),
+            (text.re_unicode_lowercase_oe, "oe"),
+            (text.re_unicode_lowercase_e, "e"),
+            (text.re_unicode_lowercase_i, "i"),
+            (text.re_unicode_lowercase_o, "o"),
+            (text.re_unicode_lowercase_u, "u"),
+            (text.re_unicode_lowercase_y, "y"),
+            (text.re_unicode_lowercase_c, "c"),
+            (text.re_unicode_lowercase_n, "n"),
+            (text.re_unicode_lowercase_ss, "ss"),
+            (text.re_unicode_uppercase_a, "A"),
+            (text.re_unicode_uppercase_ae, "AE"),
+            (text.re_unicode_uppercase_oe, "OE"),
+            (text.re_unicode_uppercase_e, "E"),
+            (text.re_unicode_uppercase_i, "I"),
+            (text.re_unicode_uppercase_o, "O"),
+            (text.re_unicode_uppercase_u, "U"),
+            (text.re_unicode_uppercase_y, "Y"),
+            (text.re_unicode_uppercase_c, "C"),
+            (text.re_unicode_uppercase_n, "N")]:
+        y = regexp.sub(replacement, y)
+    return y.encode("utf-8")
+
+
+def legacy_translate_to_ascii(value):
+    """Former implementation calling unidecode per string or character."""
+    unicode_text = decode_to_unicode(value)
+    if u"[?]" in unicode_text:
+        decoded_text = []
+        for unicode_char in unicode_text:
+            decoded_char = unidecode(unicode_char)
+            if decoded_char != "[?]":
+                decoded_text.append(decoded_char)
+        return ''.join(decoded_text).encode('ascii')
+    return unidecode(unicode_text).replace(u"[?]", u"").encode('ascii')
+
+
+def legacy_slugify(value, delim=u'-'):
+    """Former implementation calling unidecode per word."""
+    result = []
+    for word in text._punct_re.split(value.decode('utf-8').lower()):
+        result.extend(unidecode(word).split())
+    return unicode(delim.join(result))
+
+
+def author_names(count=5000, seed=42):
+    """Return UTF-8 encoded author names with accents and LaTeX escapes."""
+    rnd = random.Random(seed)
+    surnames = [u'Müller', u'Åkesson', u'Sánchez', u'Nguyễn', u'Dvořák',
+                u'Łukasiewicz', u'Ellis', u"Schr\\\"odinger", u'Çelik',
+                u'Pérez-Ñúñez', u'Smith', u'Høgh', u"G\\'omez"]
+    given = [u'J.', u'Jörg', u'Émilie', u'A.-M.', u'Zoë', u'Ryszard']
+    return [(u'%s, %s' % (rnd.choice(surnames), rnd.choice(given)))
+            .encode('utf-8') for dummy in range(count)]
+
+
+def titles(count=500, seed=42):
+    """Return UTF-8 encoded, mostly ASCII titles."""
+    rnd = random.Random(seed)
+    words = [u'measurement', u'of', u'the', u'cross', u'section', u'in',
+             u'proton-proton', u'collisions', u'at', u'13', u'TeV', u'Ω',
+             u'désintégration', u'Überblick']
+    return [u' '.join(rnd.choice(words) for dummy in range(20))
+            .encode('utf-8') for dummy in range(count)]
+
+
+PAYLOADS = {
+    'author_names': author_names,
+    'titles': titles,
+}
+
+FUNCTIONS = {
+    'strip_accents': {
+        'current': strip_accents,
+        'legacy': legacy_strip_accents,
+    },
+    'translate_to_ascii': {
+        'current': lambda value: translate_to_ascii([value]),
+        'legacy': legacy_translate_to_ascii,
+    },
+    'slugify': {
+        'current': lambda value: slugify(value.decode('utf-8')),
+        'legacy': legacy_slugify,
+    },
+}
+
+
+def run(repeat=5):
+    """Run the benchmark and return the list of results."""
+    results = []
+    for payload_name, factory in sorted(PAYLOADS.items()):
+        payload = factory()
+        for function_name, versions in sorted(FUNCTIONS.items()):
+            for version, function in sorted(versions.items()):
+                log('{0} / {1} / {2}'.format(payload_name, function_name,
+                                             version))
+                seconds = best_of(
+                    lambda: [function(value) for value in payload], repeat)
+                results.append({
+                    'payload': payload_name,
+                    'function': function_name,
+                    'version': version,
+                    'strings': len(payload),
+                    'seconds': seconds,
+                    'strings_per_second': len(payload) / seconds,
+                })
+    return results
+
+
+if __name__ == '__main__':
+    args = argument_parser(__doc__.splitlines()[0]).parse_args()
+    write_report('text', run(args.repeat), args.output)
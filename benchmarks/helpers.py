@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Helpers shared by the benchmark scripts."""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def best_of(function, repeat=5, number=1):
+    """Return the best time in seconds of ``number`` calls of ``function``."""
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_memory(function):
+    """Return peak memory in bytes allocated while running ``function``.
+
+    Without :mod:`tracemalloc` (Python 2) the growth of the maximum
+    resident set size of a forked process running ``function`` is returned
+    instead; it is coarser (page granularity) but comparable between runs.
+    Returns ``None`` if neither method is available.
+    """
+    if tracemalloc is None:
+        if resource is None or not hasattr(os, 'fork'):
+            return None
+        return _forked_peak_rss(function)
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _max_rss():
+    """Return maximum resident set size of this process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _forked_peak_rss(function):
+    """Return growth of the maximum RSS while ``function`` runs in a child.
+
+    The child starts from a copy of this process, so earlier runs do not
+    raise the baseline.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        status = 1
+        try:
+            os.close(read)
+            before = _max_rss()
+            function()
+            os.write(write, str(_max_rss() - before).encode('ascii'))
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        data = f.read()
+    dummy, status = os.waitpid(pid, 0)
+    if status:
+        raise RuntimeError('Memory measurement failed')
+    return int(data)
+
+
+def argument_parser(description):
+    """Return parser with the options common to all benchmarks."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timing repetitions (best is kept)')
+    parser.add_argument('--output', default='-',
+                        help='file for the JSON report (default: stdout)')
+    return parser
+
+
+def write_report(name, results, output='-'):
+    """Write machine-readable benchmark ``results`` as JSON."""
+    from invenio_utils.version import __version__
+    report = {
+        'benchmark': name,
+        'invenio_utils': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+    }
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if output == '-':
+        print(data)
+    else:
+        with open(output, 'w') as f:
+            f.write(data + '\n')
+    return report
+
+
+def log(message):
+    """Print progress ``message`` to stderr."""
+    print(message, file=sys.stderr)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Ordered parallel map over large iterables, shared by batch helpers."""
+
+import itertools
+from collections import deque
+
+
+def _apply(function, chunk):
+    return [function(item) for item in chunk]
+
+
+def ordered_map(make_pool, function, items, chunksize, ahead):
+    """Apply ``function`` to ``items`` in a pool and yield results in order.
+
+    Items are sent to the pool in chunks of ``chunksize`` and at most
+    ``ahead`` chunks are submitted before the consumer catches up, so that
+    the workers stay busy while huge iterables are not consumed (and held
+    in memory) all at once.  The pool is only created by calling
+    ``make_pool`` when there is at least one item; it is closed once all
+    items are processed and terminated if a call fails or the consumer
+    stops iterating.
+
+    :param make_pool: function returning a ``multiprocessing`` pool.
+    :param function: function of one item; it must be picklable for
+        process pools.
+    """
+    items = iter(items)
+    chunk = list(itertools.islice(items, chunksize))
+    if not chunk:
+        return
+    pool = make_pool()
+    pending = deque()
+    try:
+        while True:
+            while chunk and len(pending) < ahead:
+                pending.append(pool.apply_async(_apply, (function, chunk)))
+                chunk = list(itertools.islice(items, chunksize))
+            if not pending:
+                break
+            for result in pending.popleft().get():
+                yield result
+    except BaseException:
+        # Also reached when the consumer stops iterating (GeneratorExit).
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -39,15 +39,36 @@ def get_substructure(data, path):
     @type data: str|dict|list|(an indexable container)
 
     @param path: location of the data
-    @type path: list|str
+    @type path: list|str|tuple
 
     @rtype: *
     """
-
-    if not len(path):
-        return data
-
     try:
-        return get_substructure(data[path[0]], path[1:])
+        for key in path:
+            data = data[key]
     except (TypeError, IndexError, KeyError):
         return None
+    return data
+
+
+def get_substructures(datas, path):
+    """
+    Retrieve the same sub-structure from many containers.
+
+    The path is converted to a tuple only once. Containers without a
+    matching sub-structure yield None.
+
+    >>> list(get_substructures([{'a': [1]}, {'a': [2]}, {}], ['a', 0]))
+    [1, 2, None]
+
+    @param datas: iterable of containers
+    @type datas: iterable
+
+    @param path: location of the data
+    @type path: list|str|tuple
+
+    @rtype: generator
+    """
+    path = tuple(path)
+    for data in datas:
+        yield get_substructure(data, path)
@@ -19,9 +19,15 @@
 """Invenio special data structures."""
 
 import re
-from collections import MutableMapping
+import threading
+import time
+import weakref
+from collections import Mapping, MutableMapping, OrderedDict
+from multiprocessing.pool import ThreadPool
 
-from six import iteritems
+from six import iteritems, itervalues
+
+_MISSING = object()
 
 
 class LazyDict(object):
@@ -39,66 +45,95 @@ class LazyDict(object):
         lazy_dict = LazyDict(my_dict)
         # at this point the internal dictionary is empty
         lazy_dict['foo']
+
+    The function is called only once even when several threads access the
+    dictionary for the first time concurrently.
+
+    With ``ttl`` the content is evaluated again on the first access after it
+    expired, and ``on_invalidate`` is called with ``None`` whenever the
+    content is dropped (expired or :meth:`expunge` called).
     """
 
-    def __init__(self, function=dict):
+    __slots__ = ('_cached_dict', '_function', '_lock', '_ttl', '_expires',
+                 '_on_invalidate', '_timer', '__dict__', '__weakref__')
+
+    def __init__(self, function=dict, ttl=None, on_invalidate=None,
+                 timer=time.time):
         """Initialize lazy dictionary with given function.
 
         :param function: it must return a dictionary like structure
+        :param ttl: number of seconds after which the content is evaluated
+            again. ``None`` means it never expires.
+        :param on_invalidate: function called with the invalidated key
+            whenever cached content is dropped.
+        :param timer: function returning the current time in seconds.
         """
         super(LazyDict, self).__init__()
         self._cached_dict = None
         self._function = function
+        self._lock = threading.RLock()
+        self._ttl = ttl
+        self._expires = None
+        self._on_invalidate = on_invalidate
+        self._timer = timer
 
     def _evaluate_function(self):
-        self._cached_dict = self._function()
+        with self._lock:
+            if self._expires is not None and self._timer() >= self._expires:
+                self.expunge()
+            if self._cached_dict is None:
+                self._cached_dict = self._function()
+                if self._ttl is not None:
+                    self._expires = self._timer() + self._ttl
+
+    def _current(self):
+        """Return the cached dictionary, evaluating it if necessary."""
+        if self._cached_dict is None or self._expires is not None and \
+                self._timer() >= self._expires:
+            self._evaluate_function()
+        return self._cached_dict
+
+    def _invalidated(self, keys):
+        """Notify ``on_invalidate`` about dropped ``keys``."""
+        if self._on_invalidate is not None:
+            for key in keys:
+                self._on_invalidate(key)
 
     def __getitem__(self, key):
         """Return item from cache if it exists else create it."""
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return self._cached_dict.__getitem__(key)
+        return self._current().__getitem__(key)
 
     def __setitem__(self, key, value):
         """Set item to cache if it exists else create it."""
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return self._cached_dict.__setitem__(key, value)
+        return self._current().__setitem__(key, value)
 
     def __delitem__(self, key):
         """Delete item from cache if it exists else create it."""
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return self._cached_dict.__delitem__(key)
+        return self._current().__delitem__(key)
 
     def __getattr__(self, key):
         """Get cache attribute if it exists else create it."""
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return getattr(self._cached_dict, key)
+        return getattr(self._current(), key)
 
     def __iter__(self):
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return self._cached_dict.__iter__()
+        return self._current().__iter__()
 
     def iteritems(self):
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return iteritems(self._cached_dict)
+        return iteritems(self._current())
 
     def iterkeys(self):
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return self._cached_dict.iterkeys()
+        return self._current().iterkeys()
 
     def itervalues(self):
-        if self._cached_dict is None:
-            self._evaluate_function()
-        return self._cached_dict.itervalues()
+        return self._current().itervalues()
 
     def expunge(self):
-        self._cached_dict = None
+        with self._lock:
+            dropped = self._cached_dict is not None
+            self._cached_dict = None
+            self._expires = None
+        if dropped:
+            self._invalidated([None])
 
     def get(self, key, default=None):
         try:
@@ -122,45 +157,299 @@ class LaziestDict(LazyDict):
             from werkzeug.utils import import_string
             return import_string(key)
 
-        laziest_dict = LaziestDict(reader_discover)
+        laziest_dict = LaziestDict(reader_discover, ttl=3600, maxsize=100)
 
         laziest_dict['json']
         # It will give you the JsonReader class
+
+    Each key is guarded by its own lock, so concurrent accesses to the same
+    missing key evaluate the function only once while different keys are
+    evaluated in parallel.
+
+    Keys expire ``ttl`` seconds after they were evaluated and the least
+    recently used key is evicted once more than ``maxsize`` keys are cached.
+    Expired keys are dropped on access or by :meth:`purge`. With
+    ``negative_ttl`` a key whose evaluation failed raises :exc:`KeyError`
+    without calling the function again until ``negative_ttl`` seconds have
+    passed.
     """
 
-    def __init__(self, function=dict):
+    __slots__ = ('_locks', '_maxsize', '_negative_ttl', '_stamps',
+                 '_failures')
+
+    def __init__(self, function=dict, ttl=None, negative_ttl=None,
+                 maxsize=None, on_invalidate=None, timer=time.time):
         """Initialize laziest dictionary with given function.
 
         :param function: it must accept one parameter (the key of the
             dictionary) and returns the element which will be store that key.
+        :param ttl: number of seconds after which a key is evaluated again.
+            ``None`` means keys never expire.
+        :param negative_ttl: number of seconds a failed evaluation is
+            remembered. ``None`` means failures are not cached.
+        :param maxsize: maximum number of cached keys. ``None`` means
+            unbounded.
+        :param on_invalidate: function called with the key whenever a cached
+            key expires, is evicted or is invalidated.
+        :param timer: function returning the current time in seconds.
         """
-        super(LaziestDict, self).__init__(function)
+        super(LaziestDict, self).__init__(
+            function, on_invalidate=on_invalidate, timer=timer)
+        self._locks = {}
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._negative_ttl = negative_ttl
+        # Expiry time of each key in LRU order, only kept when needed.
+        self._stamps = None
+        if ttl is not None or maxsize is not None:
+            self._stamps = OrderedDict()
+        self._failures = OrderedDict()
 
     def _evaluate_function(self):
         """Create empty dict if necessary."""
-        if self._cached_dict is None:
-            self._cached_dict = {}
+        with self._lock:
+            if self._cached_dict is None:
+                self._cached_dict = {}
+
+    def _lookup(self, key):
+        """Return the live value of ``key`` or ``_MISSING``.
+
+        The key is marked as recently used.
+        """
+        cached = self._current()
+        if self._stamps is None:
+            # A single dictionary read needs no lock.
+            return cached.get(key, _MISSING)
+        with self._lock:
+            value = cached.get(key, _MISSING)
+            if value is _MISSING:
+                return value
+            expires = self._stamps.pop(key, None)
+            if expires is None or self._timer() < expires:
+                self._stamps[key] = expires
+                return value
+            cached.pop(key, None)
+        self._invalidated([key])
+        return _MISSING
+
+    def _store(self, key, value):
+        """Cache ``value`` for ``key`` and evict keys above ``maxsize``."""
+        evicted = []
+        with self._lock:
+            cached = self._current()
+            cached[key] = value
+            if self._stamps is not None:
+                self._stamps.pop(key, None)
+                self._stamps[key] = None if self._ttl is None else \
+                    self._timer() + self._ttl
+                while self._maxsize is not None and \
+                        len(self._stamps) > self._maxsize:
+                    old_key, dummy = self._stamps.popitem(last=False)
+                    cached.pop(old_key, None)
+                    evicted.append(old_key)
+        self._invalidated(evicted)
+
+    def _failed(self, key):
+        """Check whether ``key`` recently failed to evaluate."""
+        with self._lock:
+            retry = self._failures.get(key)
+            if retry is None:
+                return False
+            if self._timer() < retry:
+                return True
+            del self._failures[key]
+            return False
+
+    def _evaluate_key(self, key):
+        """Evaluate and store ``key`` unless another thread already did."""
+        # The per-key lock is shared by all threads evaluating the key and
+        # dropped when the last one leaves, so a thread still waiting on it
+        # never runs concurrently with a caller arriving later.
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    return value
+                if self._failed(key):
+                    raise KeyError(key)
+                try:
+                    value = self._function(key)
+                except:
+                    if self._negative_ttl is not None:
+                        self._remember_failure(key)
+                    raise KeyError(key)
+                self._store(key, value)
+                return value
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def _remember_failure(self, key):
+        """Cache the failed evaluation of ``key`` for ``negative_ttl``."""
+        with self._lock:
+            now = self._timer()
+            self._failures.pop(key, None)
+            # Failures are kept in the order they expire in.
+            while self._failures and \
+                    next(itervalues(self._failures)) <= now:
+                self._failures.popitem(last=False)
+            self._failures[key] = now + self._negative_ttl
+            while self._maxsize is not None and \
+                    len(self._failures) > self._maxsize:
+                self._failures.popitem(last=False)
 
     def __getitem__(self, key):
-        if self._cached_dict is None:
-            self._evaluate_function()
-        if key not in self._cached_dict:
-            try:
-                self._cached_dict.__setitem__(key, self._function(key))
-            except:
-                raise KeyError(key)
-        return self._cached_dict.__getitem__(key)
+        value = self._lookup(key)
+        if value is _MISSING:
+            value = self._evaluate_key(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._failures.pop(key, None)
+        self._store(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._current()[key]
+            if self._stamps is not None:
+                self._stamps.pop(key, None)
 
     def __contains__(self, key):
-        if self._cached_dict is None:
-            self._evaluate_function()
-        if key not in self._cached_dict:
-            try:
-                self.__getitem__(key)
-            except:
-                return False
+        try:
+            self.__getitem__(key)
+        except KeyError:
+            return False
         return True
 
+    def invalidate(self, key):
+        """Drop ``key`` (and its cached failure) so it is evaluated again."""
+        with self._lock:
+            self._failures.pop(key, None)
+            dropped = self._cached_dict is not None and \
+                self._cached_dict.pop(key, _MISSING) is not _MISSING
+            if self._stamps is not None:
+                self._stamps.pop(key, None)
+        if dropped:
+            self._invalidated([key])
+
+    def purge(self):
+        """Drop all expired keys and failures.
+
+        :return: list of dropped keys
+        """
+        expired = []
+        with self._lock:
+            now = self._timer()
+            for key, retry in list(self._failures.items()):
+                if now >= retry:
+                    del self._failures[key]
+            if self._stamps is not None and self._ttl is not None:
+                for key, expires in list(self._stamps.items()):
+                    if now >= expires:
+                        del self._stamps[key]
+                        self._cached_dict.pop(key, None)
+                        expired.append(key)
+        self._invalidated(expired)
+        return expired
+
+    def expunge(self):
+        with self._lock:
+            keys = list(self._cached_dict or ())
+            self._cached_dict = None
+            self._failures.clear()
+            if self._stamps is not None:
+                self._stamps.clear()
+        self._invalidated(keys)
+
+    def preload(self, keys, workers=None):
+        """Evaluate many ``keys`` in parallel, e.g. when a worker starts.
+
+        :param keys: iterable of keys to evaluate
+        :param workers: number of threads (defaults to the number of CPUs)
+        :return: list of keys which could not be evaluated
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        pool = ThreadPool(workers)
+        try:
+            loaded = pool.map(self.__contains__, keys)
+        finally:
+            pool.close()
+            pool.join()
+        return [key for key, found in zip(keys, loaded) if not found]
+
+
+_KEY, _INDEX, _INVALID_INDEX = range(3)
+
+_compiled_keys = {}
+_MAX_COMPILED_KEYS = 1024
+
+
+def _compile_key(key):
+    """Return smart key ``key`` parsed into a tuple of operations.
+
+    Each operation is a ``(part, kind, index)`` tuple where ``part`` is the
+    raw key chunk, ``kind`` tells whether it is a dictionary key (or a
+    fan-out over a list) or a list index, and ``index`` holds the parsed
+    integer or slice.  Results are cached like compiled regular
+    expressions.
+    """
+    try:
+        return _compiled_keys[key]
+    except KeyError:
+        pass
+    operations = []
+    for part in SmartDict.split_key_pattern.split(key):
+        if ']' not in part:
+            operations.append((part, _KEY, None))
+            continue
+        index = part[:-1].replace('n', '-1')
+        try:
+            try:
+                index = int(index)
+            except ValueError:
+                index = slice(*[int(x.strip()) if x.strip() else None
+                                for x in index.split(':')])
+            operations.append((part, _INDEX, index))
+        except (ValueError, TypeError):
+            operations.append((part, _INVALID_INDEX, None))
+    operations = tuple(operations)
+    if len(_compiled_keys) >= _MAX_COMPILED_KEYS:
+        _compiled_keys.clear()
+    _compiled_keys[key] = operations
+    return operations
+
+
+def _evaluate_key(operations, value):
+    """Apply compiled smart key ``operations`` to ``value``."""
+    for part, kind, index in operations:
+        if isinstance(value, _MAPPINGS):
+            value = value[part]
+        elif kind == _INDEX:
+            value = value[index]
+        elif kind == _KEY:
+            # Fan out over list items, skipping those without the key.
+            values = []
+            for item in value:
+                if isinstance(item, _MAPPINGS):
+                    try:
+                        values.append(item[part])
+                    except KeyError:
+                        continue
+            value = values
+        else:
+            raise ValueError('Invalid list index {0!r}'.format(part))
+    return value
+
 
 class SmartDict(object):
 
@@ -197,65 +486,61 @@ class SmartDict(object):
         .. code-block:: python
 
             >>> d = SmartDict({'a': 3, 'b': {'.': 5}})
+
+    When created with ``track_changes=True`` the keys written through
+    :meth:`__setitem__`, :meth:`set`, :meth:`__delitem__` and :meth:`update`
+    are recorded and can be retrieved with :meth:`changes`:
+
+    .. code-block:: python
+
+        >>> d = SmartDict({'a': {'b': 1}}, track_changes=True)
+        >>> d['a.c'] = 2
+        >>> d.changes()
+        frozenset(['a.c'])
+
+    Values modified in place, e.g. ``d['a']['b'] = 3``, are not tracked.
     """
 
+    __slots__ = ('_dict', '_changes', '__dict__', '__weakref__')
+
     split_key_pattern = re.compile('\.|\[')
     main_key_pattern = re.compile('\..*|\[.*')
 
-    def __init__(self, d=None):
+    def __init__(self, d=None, track_changes=False):
         self._dict = d if d is not None else dict()
+        self._changes = set() if track_changes else None
         super(SmartDict, self).__init__()
 
+    def __getstate__(self):
+        """Return instance state including the slotted attributes."""
+        state = dict(getattr(self, '__dict__', {}))
+        state['_dict'] = self._dict
+        state['_changes'] = self._changes
+        return state
+
+    def __setstate__(self, state):
+        """Restore instance state returned by :meth:`__getstate__`."""
+        self._changes = None
+        for key, value in iteritems(state):
+            setattr(self, key, value)
+
     def __getitem__(self, key):
         """Return item as `dict.__getitem__` but using 'smart queries'.
 
         .. note::
             Accessing one value in a normal way, meaning d['a'], is almost as
-            fast as accessing a regular dictionary. But using the special
-            name convention is a bit slower than using the regular access:
-
-            .. code-block:: python
-
-                >>> %timeit x = dd['a[0].b']
-                100000 loops, best of 3: 3.94 us per loop
-                >>> %timeit x = dd['a'][0]['b']
-                1000000 loops, best of 3: 598 ns per loop
+            fast as accessing a regular dictionary. Smart keys are parsed
+            only once into a cached sequence of operations, so repeating the
+            same query (e.g. over many records) only pays for walking the
+            structure.
         """
-        def getitem(k, v, first=True):
-            if isinstance(v, dict):
-                return v[k]
-            elif ']' in k:
-                k = k[:-1].replace('n', '-1')
-                # Work around for list indexes and slices
-                try:
-                    return v[int(k)]
-                except ValueError:
-                    return v[slice(*map(
-                        lambda x: int(x.strip()) if x.strip() else None,
-                        k.split(':')
-                    ))]
-            elif not first:
-                raise KeyError
-            else:
-                tmp = []
-                for inner_v in v:
-                    try:
-                        tmp.append(getitem(k, inner_v, first=False))
-                    except KeyError:
-                        continue
-                return tmp
-
         # Check if we are using python regular keys
         try:
             return self._dict[key]
         except KeyError:
             pass
 
-        keys = SmartDict.split_key_pattern.split(key)
-        value = self._dict
-        for k in keys:
-            value = getitem(k, value)
-        return value
+        return _evaluate_key(_compile_key(key), self._dict)
 
     def __setitem__(self, key, value, extend=False, **kwargs):
         # check if the key is composed only by special chars
@@ -268,10 +553,14 @@ class SmartDict(object):
         else:
             keys = SmartDict.split_key_pattern.split(key)
             self.__setitem(self._dict, keys[0], keys[1:], value, extend)
+        if self._changes is not None:
+            self._changes.add(key)
 
     def __delitem__(self, key):
         """Delete item only from first level dictionary keys."""
         del self._dict[key]
+        if self._changes is not None:
+            self._changes.add(key)
 
     def __contains__(self, key):
 
@@ -387,11 +676,316 @@ class SmartDict(object):
 
     def update(self, E, **F):
         """Proxy `dict` update method."""
-        self._dict.update(E, **F)
+        if self._changes is None:
+            self._dict.update(E, **F)
+        else:
+            items = dict(E, **F)
+            self._dict.update(items)
+            self._changes.update(items)
+
+    def changes(self, clear=False):
+        """Return set of keys modified since creation or the last clear.
+
+        :param clear: if ``True`` start recording a new set of changes
+        :raises RuntimeError: if the dictionary does not track changes
+        """
+        if self._changes is None:
+            raise RuntimeError('Change tracking is not enabled.')
+        changes = frozenset(self._changes)
+        if clear:
+            self._changes.clear()
+        return changes
 
 MutableMapping.register(SmartDict)
 
 
+class KeyTable(object):
+
+    """Ordered tuple of keys shared by all :class:`CompactDict` instances.
+
+    Tables are interned, so records with the same keys in the same order
+    point to the very same table and only keep their values.
+    """
+
+    __slots__ = ('keys', 'index', '__weakref__')
+
+    _tables = weakref.WeakValueDictionary()
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = dict((key, i) for i, key in enumerate(keys))
+
+    @classmethod
+    def get(cls, keys):
+        """Return the interned table for ``keys``."""
+        keys = tuple(keys)
+        table = cls._tables.get(keys)
+        if table is None:
+            table = cls._tables.setdefault(keys, cls(keys))
+        return table
+
+
+def _mutable_mapping(cls):
+    """Add the mixin methods of ``MutableMapping`` to the slotted ``cls``.
+
+    ``MutableMapping`` declares no ``__slots__`` on Python 2, so deriving
+    from it would give every instance a ``__dict__`` and ``__weakref__``.
+    """
+    for base in (MutableMapping, Mapping):
+        for name, value in list(iteritems(vars(base))):
+            if name in vars(cls) or name.startswith('_abc') or name in (
+                    '__abstractmethods__', '__doc__', '__module__',
+                    '__slots__', '__dict__', '__weakref__'):
+                continue
+            setattr(cls, name, value)
+    MutableMapping.register(cls)
+    return cls
+
+
+@_mutable_mapping
+class CompactDict(object):
+
+    """Memory-compact mapping for large sets of similar records.
+
+    The keys live in a shared :class:`KeyTable` and every instance only
+    stores a list of values. Adding or removing a key moves the instance
+    to another interned table.
+
+    Example:
+
+    .. code-block:: python
+
+        >>> a = CompactDict([('title', 'A'), ('year', 2015)])
+        >>> b = CompactDict([('title', 'B'), ('year', 2014)])
+        >>> a._table is b._table
+        True
+    """
+
+    __slots__ = ('_table', '_values')
+
+    def __init__(self, *args, **kwargs):
+        keys, values = [], []
+        for key, value in iteritems(dict(*args, **kwargs)):
+            keys.append(key)
+            values.append(value)
+        self._table = KeyTable.get(keys)
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._table.index[key]]
+
+    def __setitem__(self, key, value):
+        try:
+            self._values[self._table.index[key]] = value
+        except KeyError:
+            self._table = KeyTable.get(self._table.keys + (key, ))
+            self._values.append(value)
+
+    def __delitem__(self, key):
+        index = self._table.index[key]
+        keys = self._table.keys
+        self._table = KeyTable.get(keys[:index] + keys[index + 1:])
+        del self._values[index]
+
+    def __iter__(self):
+        return iter(self._table.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._table.index
+
+    def copy(self):
+        """Return shallow copy sharing the key table."""
+        new = self.__class__.__new__(self.__class__)
+        new._table, new._values = self._table, list(self._values)
+        return new
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, dict(self))
+
+    def __getstate__(self):
+        return self._table.keys, self._values
+
+    def __setstate__(self, state):
+        keys, self._values = state
+        self._table = KeyTable.get(keys)
+
+
+_MAPPINGS = (dict, CompactDict)
+
+
+def _copy_path(root, keys):
+    """Return shallow copy of ``root`` with containers along ``keys`` copied.
+
+    Everything outside of the path is shared with the original structure.
+    """
+    root = node = root.copy()
+    for key in keys:
+        try:
+            if ']' in key:
+                key = int(key[:-1].replace('n', '-1'))
+            child = node[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            break
+        if isinstance(child, _MAPPINGS):
+            child = child.copy()
+        elif isinstance(child, list):
+            child = list(child)
+        else:
+            break
+        node[key] = child
+        node = child
+    return root
+
+
+def _diff(old, new, path, changes):
+    """Collect smart keys of values differing between ``old`` and ``new``."""
+    if old is new:
+        return
+    if isinstance(old, _MAPPINGS) and isinstance(new, _MAPPINGS):
+        for key in set(old) | set(new):
+            key_path = '{0}.{1}'.format(path, key) if path else key
+            if key not in old or key not in new:
+                changes.add(key_path)
+            else:
+                _diff(old[key], new[key], key_path, changes)
+    elif isinstance(old, list) and isinstance(new, list) \
+            and len(old) == len(new):
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            _diff(old_item, new_item, '{0}[{1}]'.format(path, index), changes)
+    elif old != new:
+        changes.add(path)
+
+
+class PersistentSmartDict(SmartDict):
+
+    """Immutable :class:`SmartDict` whose updates return new versions.
+
+    Only the containers along the modified path are copied, the rest of the
+    structure is shared between versions.  Keeping a reference to a version
+    is therefore an O(1) snapshot and :meth:`diff` only descends into
+    subtrees which are not shared.
+
+    Example:
+
+    .. code-block:: python
+
+        >>> v1 = PersistentSmartDict({'a': [{'b': 1}], 'c': {'d': 2}})
+        >>> v2 = v1.set('a[0].b', 3)
+        >>> v1['a[0].b'], v2['a[0].b']
+        (1, 3)
+        >>> v1['c'] is v2['c']
+        True
+        >>> v1.diff(v2)
+        set(['a[0].b'])
+
+    .. note::
+        Values returned by lookups are shared with other versions and must
+        be treated as read-only.
+    """
+
+    __slots__ = ()
+
+    def __setitem__(self, key, value, extend=False, **kwargs):
+        raise TypeError('{0} is immutable, use set()'.format(
+            self.__class__.__name__))
+
+    def __delitem__(self, key):
+        raise TypeError('{0} is immutable, use delete()'.format(
+            self.__class__.__name__))
+
+    def set(self, key, value, extend=False, **kwargs):
+        """Return new version with ``value`` set under ``key``.
+
+        Accepts the same keys and ``extend`` flag as :meth:`SmartDict.set`.
+        """
+        new = self.__class__(
+            _copy_path(self._dict, SmartDict.split_key_pattern.split(key)))
+        SmartDict.__setitem__(new, key, value, extend, **kwargs)
+        return new
+
+    def delete(self, key):
+        """Return new version without first level ``key``."""
+        new = self.__class__(self._dict.copy())
+        del new._dict[key]
+        return new
+
+    def update(self, E, **F):
+        """Return new version updated like `dict.update`."""
+        new = self.__class__(self._dict.copy())
+        new._dict.update(E, **F)
+        return new
+
+    def diff(self, other):
+        """Return set of smart keys whose values differ in ``other``.
+
+        :param other: another version or any :class:`SmartDict`
+        """
+        changes = set()
+        _diff(self._dict, other._dict, '', changes)
+        return changes
+
+
+def compact(data):
+    """Return ``data`` with all nested dictionaries turned into
+    :class:`CompactDict` instances sharing their key tables.
+
+    The result can be wrapped in :class:`SmartDict` as usual.
+
+    :param data: structure made of dictionaries and lists
+    """
+    if isinstance(data, dict):
+        return CompactDict((key, compact(value))
+                           for key, value in iteritems(data))
+    elif isinstance(data, list):
+        return [compact(value) for value in data]
+    return data
+
+
+def query_records(keys, records, default=None):
+    """Evaluate the same smart ``keys`` over many ``records`` at once.
+
+    Keys are compiled once for the whole batch and the result is returned
+    column-wise, i.e. one list per key holding the value for every record:
+
+    .. code-block:: python
+
+        >>> records = [{'title': {'title': 'A'}, 'authors': [{'name': 'x'}]},
+        ...            {'title': {'title': 'B'}, 'authors': []}]
+        >>> query_records(['title.title', 'authors.name'], records)
+        [['A', 'B'], [['x'], []]]
+
+    :param keys: list of smart keys as accepted by :class:`SmartDict`
+    :param records: iterable of :class:`SmartDict` instances or plain
+        dictionaries
+    :param default: value used when a key is missing in a record, including
+        list indexes out of range and ``None`` along the path
+    :return: list of columns in the same order as ``keys``
+    """
+    columns = [[] for _ in keys]
+    plan = []
+    for key, column in zip(keys, columns):
+        # Plain keys are looked up directly, smart keys are compiled once.
+        operations = None
+        if '.' in key or '[' in key:
+            operations = _compile_key(key)
+        plan.append((key, operations, column.append))
+    for record in records:
+        if isinstance(record, SmartDict):
+            record = record._dict
+        for key, operations, append in plan:
+            try:
+                if operations is None:
+                    append(record[key])
+                else:
+                    append(_evaluate_key(operations, record))
+            except (KeyError, IndexError, TypeError):
+                append(default)
+    return columns
+
+
 class DotableDict(dict):
 
     """Make nested python dictionaries accessable using dot notation.
@@ -405,6 +999,8 @@ class DotableDict(dict):
         ...  [{'b': 3, 'c': 5}]
     """
 
+    __slots__ = ()
+
     def __getattr__(self, key):
         """Return value from dictionary.
 
@@ -417,7 +1013,45 @@ class DotableDict(dict):
         self[key] = value
 
 
+def _iterlists(multidict):
+    """Return iterator over ``(key, values)`` of ``multidict``."""
+    lists = getattr(multidict, 'iterlists', None) or \
+        getattr(multidict, 'lists', None)
+    return lists() if lists is not None else iteritems(multidict)
+
+
+def iter_flattened(multidict):
+    """Yield ``(key, value)`` pairs of a ``MultiDict`` without copying it.
+
+    Keys holding a single value yield the value itself, keys holding more
+    values yield the whole list. Besides werkzeug ``MultiDict`` (with either
+    ``iterlists()`` or ``lists()``) a plain dictionary of lists is accepted;
+    its values which are not lists are yielded unchanged.
+    """
+    for key, value in _iterlists(multidict):
+        if type(value) is list and len(value) == 1:
+            value = value[0]
+        yield key, value
+
+
 def flatten_multidict(multidict):
-    """Return flattened dictionary from ``MultiDict``."""
-    return dict([(key, value if len(value) > 1 else value[0])
-                 for (key, value) in multidict.iterlists()])
+    """Return flattened dictionary from ``MultiDict``.
+
+    See :func:`iter_flattened` for the accepted types.
+    """
+    result = {}
+    for key, value in _iterlists(multidict):
+        if type(value) is list and len(value) == 1:
+            value = value[0]
+        result[key] = value
+    return result
+
+
+def flatten_multidicts(multidicts):
+    """Flatten many ``MultiDict`` instances, e.g. a batch of submitted forms.
+
+    :param multidicts: iterable of ``MultiDict`` or dictionaries of lists
+    :return: generator of flattened dictionaries
+    """
+    for multidict in multidicts:
+        yield flatten_multidict(multidict)
@@ -19,35 +19,728 @@
 
 """
 Memoisation utilities.
+
+Both :class:`Memoise` and :func:`memoize` keep their results in a
+:class:`MemoiseCache`, which can be bounded in size (least recently used
+entries are evicted first) and in time (entries expire after ``ttl``
+seconds).  Workers on the same host can share results by passing a
+:class:`FileSystemCache` as ``cache`` instead.
+
+Concurrent calls for the same missing key are collapsed: one caller
+computes the value while the others wait for it (see :class:`SingleFlight`).
+Coroutine functions get the same protection with :func:`memoize_async`.
+
+Every memoised callable provides ``cache_info()``, ``cache_clear()`` and
+``cache_evict(*args, **kwargs)`` and is listed by :func:`memoise_report`.
+Any mapping can serve as ``cache``; subclasses of :class:`CacheBackend`
+additionally report hit/miss statistics.
+Functions decorated with :func:`memoize` also expose the key builder as
+``cache_key(*args, **kwargs)``.
+
+Usage example:
+
+.. code-block:: python
+
+    @memoize(maxsize=1000, ttl=3600)
+    def get_record_title(recid):
+        ...
+
+    get_record_title.cache.hits
 """
+
+import errno
 import functools
+import inspect
+import os
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import Mapping, OrderedDict, Sequence, Set, namedtuple
+
+import six
+from six import iteritems
+from six.moves import cPickle as pickle
+
+from .hash import sha1
+from .serializers import ZlibPickle
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+_MISSING = object()
+_KWARGS_MARK = object()
+
+_registry = weakref.WeakSet()
+
+CacheInfo = namedtuple('CacheInfo',
+                       'hits misses evictions maxsize currsize nbytes')
+"""Statistics returned by ``cache_info()`` of memoised callables.
+
+``nbytes`` is the number of bytes taken by the entries themselves, not by
+the objects they refer to, or ``None`` if the backend cannot tell.
+"""
+
+
+KEY_FUNCTIONS = {
+    bytearray: bytes,
+}
+"""Functions turning instances of unhashable types into hashable keys.
+
+The mapping can be extended with custom types or overridden per decorated
+function via the ``key_functions`` argument of :func:`make_key`.  Lists,
+dictionaries and sets are handled by :func:`freeze` itself.
+"""
+
+
+def _sorted(items):
+    """Return ``items`` as a tuple in a deterministic order."""
+    items = list(items)
+    try:
+        return tuple(sorted(items))
+    except TypeError:
+        # Items of mutually unorderable types.
+        return tuple(sorted(items, key=lambda item: (
+            type(item).__name__, repr(item))))
+
+
+def freeze(value, key_functions=None):
+    """Return a hashable representation of ``value``.
+
+    Tuples, lists, mappings and sets are frozen recursively, other types
+    are converted by the matching function from ``key_functions`` (defaults
+    to :data:`KEY_FUNCTIONS`) and hashable values are returned unchanged.
+
+    :raises TypeError: if an unhashable value cannot be converted.
+    """
+    if key_functions is None:
+        key_functions = KEY_FUNCTIONS
+    if isinstance(value, tuple):
+        return tuple(freeze(item, key_functions) for item in value)
+    for cls in type(value).__mro__:
+        if cls in key_functions:
+            return key_functions[cls](value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        pass
+    # Sorted (not frozenset) so that the key pickles identically in every
+    # process, which file based caches rely on.
+    if isinstance(value, Mapping):
+        return (Mapping, _sorted((key, freeze(item, key_functions))
+                                 for key, item in iteritems(value)))
+    if isinstance(value, Set):
+        return (Set, _sorted(freeze(item, key_functions) for item in value))
+    if isinstance(value, Sequence):
+        return (Sequence, tuple(freeze(item, key_functions)
+                                for item in value))
+    raise TypeError('Cannot build cache key from unhashable type {0}'.format(
+        type(value).__name__))
+
+
+def make_key(function, key_functions=None, typed=True):
+    """Return a cache key builder for ``function``.
+
+    The builder accepts the same arguments as ``function`` and normalises
+    them against its signature, so ``f(1)``, ``f(1, 2)``, ``f(a=1)`` and
+    ``f(1, b=2)`` all produce the same key for ``def f(a, b=2)``.  Keys are
+    plain tuples; unhashable arguments are converted by :func:`freeze`.
+
+    With ``typed`` (the default) the types of the arguments are part of the
+    key, so ``f(1)``, ``f(True)`` and ``f(1.0)`` or ``f('a')`` and
+    ``f(u'a')`` are cached separately as they used to be.
+    """
+    if key_functions is not None:
+        custom, key_functions = key_functions, dict(KEY_FUNCTIONS)
+        key_functions.update(custom)
+    try:
+        spec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+        names, _, _, defaults = spec(function)[:4]
+    except TypeError:
+        # Builtins and other callables without an introspectable signature.
+        names, defaults = [], None
+    names = tuple(names)
+    defaults = dict(zip(names[-len(defaults):], defaults)) if defaults else {}
+
+    def builder(*args, **kwargs):
+        key = args
+        if len(args) < len(names):
+            key = list(args)
+            for name in names[len(args):]:
+                if name in kwargs:
+                    key.append(kwargs.pop(name))
+                elif name in defaults:
+                    key.append(defaults[name])
+                else:
+                    # Missing argument; the call itself will fail.
+                    break
+            key = tuple(key)
+        if typed:
+            types = tuple(type(value) for value in key)
+        if kwargs:
+            items = tuple(sorted(iteritems(kwargs)))
+            key += (_KWARGS_MARK, ) + items
+            if typed:
+                types += tuple(type(value) for dummy, value in items)
+        if typed:
+            key += types
+        try:
+            hash(key)
+        except TypeError:
+            key = freeze(key, key_functions)
+        return key
+    return builder
+
+
+class CacheBackend(object):
+
+    """Base class of cache backends used by the memoisation helpers.
+
+    Subclasses implement ``get(key, default)``, ``__setitem__``,
+    ``__delitem__`` (raising :exc:`KeyError` for missing keys),
+    ``__contains__``, ``__len__`` and ``clear()`` and update the ``hits``,
+    ``misses`` and ``evictions`` counters.  :meth:`age` and :meth:`nbytes`
+    may be overridden when the backend can answer them.
+    """
+
+    maxsize = None
+
+    def __init__(self):
+        """Initialise counters."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        """Return value for ``key`` or raise :exc:`KeyError`."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def age(self, key):
+        """Return seconds since ``key`` was stored or ``None``."""
+        return None
+
+    def nbytes(self):
+        """Return bytes used by the entries or ``None`` if unknown."""
+        return None
+
+    def info(self):
+        """Return cache statistics as :data:`CacheInfo`."""
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         self.maxsize, len(self), self.nbytes())
+
+
+class MemoiseCache(CacheBackend):
+
+    """Thread-safe mapping with an optional LRU size bound and entry TTL.
+
+    :param maxsize: maximum number of entries kept; when it is exceeded the
+        least recently used entry is evicted. ``None`` means unbounded.
+    :param ttl: number of seconds after which an entry expires. ``None``
+        means entries never expire.
+    :param timer: function returning the current time in seconds.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, timer=time.time):
+        """Initialise."""
+        super(MemoiseCache, self).__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        """Return the live value for ``key`` or ``_MISSING``.
+
+        Must be called with the lock held.
+        """
+        try:
+            created, value = self._data.pop(key)
+        except KeyError:
+            return _MISSING
+        if self.ttl is not None and self.timer() - created >= self.ttl:
+            self.evictions += 1
+            return _MISSING
+        # Re-insert to mark the entry as the most recently used one.
+        self._data[key] = (created, value)
+        return value
+
+    def get(self, key, default=None):
+        """Return value for ``key`` and update hit/miss counters."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        """Store ``value`` and evict old entries if the cache is full."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (self.timer(), value)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+    def __delitem__(self, key):
+        """Remove ``key`` from the cache."""
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        """Check if ``key`` has a live entry without touching counters."""
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def __len__(self):
+        """Return number of stored entries (including expired ones)."""
+        return len(self._data)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def age(self, key):
+        """Return seconds since ``key`` was stored or ``None``."""
+        with self._lock:
+            try:
+                created, dummy = self._data[key]
+            except KeyError:
+                return None
+            return self.timer() - created
+
+    def nbytes(self):
+        """Return approximate memory used by the entries in bytes.
+
+        Only the entries themselves are measured, not the objects they
+        refer to.
+        """
+        with self._lock:
+            return sys.getsizeof(self._data) + sum(
+                sys.getsizeof(key) + sys.getsizeof(entry) +
+                sys.getsizeof(entry[1])
+                for key, entry in iteritems(self._data))
+
+
+class FileSystemCache(CacheBackend):
 
+    """Cache storing entries as files in a directory shared by processes.
 
-class Memoise:
+    Values are serialized with :class:`~invenio_utils.serializers.ZlibPickle`
+    and written atomically, so several workers on the same host can read and
+    fill the same cache.  Each memoised function should use its own
+    directory.  When ``maxsize`` is exceeded the oldest entries are removed
+    first; hit/miss/eviction counters are kept per process.
+
+    :param directory: directory holding the cache files; it is created if
+        it does not exist.
+    :param maxsize: maximum number of entries kept. ``None`` means unbounded.
+    :param ttl: number of seconds after which an entry expires. ``None``
+        means entries never expire.
+    :param timer: function returning the current time in seconds.
+    """
+
+    suffix = '.cache'
+
+    def __init__(self, directory, maxsize=None, ttl=None, timer=time.time):
+        """Initialise."""
+        super(FileSystemCache, self).__init__()
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        # Entries counted by this process since the directory was last
+        # listed; writes of other processes are noticed by the next prune.
+        self._count = None
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+        digest = sha1(pickle.dumps(key, pickle.HIGHEST_PROTOCOL)).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def _entries(self):
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(self.suffix)]
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _lookup(self, key):
+        """Return the live value for ``key`` or ``_MISSING``."""
+        path = self._path(key)
+        try:
+            if self.ttl is not None and \
+                    self.timer() - os.path.getmtime(path) >= self.ttl:
+                self._remove(path)
+                self.evictions += 1
+                return _MISSING
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return _MISSING
+        try:
+            return ZlibPickle.loads(data)
+        except Exception:
+            # Corrupted or truncated entry, e.g. written by an incompatible
+            # version or by a crashed process; unpickling can fail with
+            # about any exception.
+            self._remove(path)
+            return _MISSING
+
+    def get(self, key, default=None):
+        """Return value for ``key`` and update hit/miss counters."""
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        """Store ``value`` and evict old entries if the cache is full."""
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(ZlibPickle.dumps(value))
+            now = self.timer()
+            os.utime(tmp, (now, now))
+            new = not os.path.exists(path)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Windows does not replace existing files.
+                self._remove(path)
+                os.rename(tmp, path)
+        except Exception:
+            self._remove(tmp)
+            raise
+        if self.maxsize is not None and new:
+            with self._lock:
+                if self._count is not None:
+                    self._count += 1
+                if self._count is None or self._count > self.maxsize:
+                    self._prune()
+
+    def _prune(self):
+        """Remove the oldest entries above ``maxsize``.
+
+        The directory is only listed when the tracked number of entries
+        exceeds ``maxsize``, not on every write.
+        """
+        entries = self._entries()
+        self._count = len(entries)
+        if len(entries) <= self.maxsize:
+            return
+        mtimes = []
+        for path in entries:
+            try:
+                mtimes.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        mtimes.sort()
+        for dummy, path in mtimes[:len(mtimes) - self.maxsize]:
+            self._remove(path)
+            self.evictions += 1
+        self._count = min(len(mtimes), self.maxsize)
+
+    def __delitem__(self, key):
+        """Remove ``key`` from the cache."""
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            raise KeyError(key)
+        self._count = None
+
+    def __contains__(self, key):
+        """Check if ``key`` has a live entry without touching counters."""
+        return self._lookup(key) is not _MISSING
+
+    def __len__(self):
+        """Return number of stored entries (including expired ones)."""
+        return len(self._entries())
+
+    def clear(self):
+        """Remove all entries."""
+        for path in self._entries():
+            self._remove(path)
+        self._count = None
+
+    def age(self, key):
+        """Return seconds since ``key`` was stored or ``None``."""
+        try:
+            return self.timer() - os.path.getmtime(self._path(key))
+        except OSError:
+            return None
+
+    def nbytes(self):
+        """Return disk space used by the entries in bytes."""
+        size = 0
+        for path in self._entries():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                continue
+        return size
+
+
+class SingleFlight(object):
+
+    """Make sure only one call per key is running at the same time.
+
+    Callers asking for a key which is already being computed by another
+    thread block until that computation finishes and receive its result
+    (or its exception).
+    """
+
+    class _Call(object):
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.value = None
+            self.exc_info = None
+
+    def __init__(self):
+        """Initialise."""
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """Return ``function(*args, **kwargs)`` shared among callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = self._Call()
+        if not owner:
+            call.event.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.value
+        try:
+            call.value = function(*args, **kwargs)
+        except BaseException:
+            # Also e.g. KeyboardInterrupt or SystemExit: waiters must not
+            # mistake an aborted computation for a ``None`` result.
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.value
+
+
+def _peek(cache, key):
+    """Return the value cached for ``key`` or ``_MISSING``.
+
+    Checking membership first keeps a miss from being counted twice.
+    """
+    if key in cache:
+        return cache.get(key, _MISSING)
+    return _MISSING
+
+
+class Memoise(object):
     """
     Basic memoisation helper.
     Usage: fun = Memoise(fun)
     """
 
-    def __init__(self, function):
-        """Initialise."""
-        self.memo = {}
+    def __init__(self, function, maxsize=None, ttl=None, cache=None):
+        """Initialise.
+
+        :param cache: cache instance to use instead of a new
+            :class:`MemoiseCache`, e.g. a :class:`FileSystemCache`.
+        """
+        if cache is None:
+            cache = MemoiseCache(maxsize=maxsize, ttl=ttl)
+        self.memo = cache
         self.function = function
+        self._flight = SingleFlight()
+        _registry.add(self)
+
+    def _compute(self, *args):
+        # The previous owner may have stored the value since our miss.
+        value = _peek(self.memo, args)
+        if value is _MISSING:
+            value = self.memo[args] = self.function(*args)
+        return value
 
     def __call__(self, *args):
         """Run and eventually memoise."""
-        if args not in self.memo:
-            self.memo[args] = self.function(*args)
-        return self.memo[args]
+        value = self.memo.get(args, _MISSING)
+        if value is _MISSING:
+            value = self._flight.do(args, self._compute, *args)
+        return value
+
+    def cache_info(self):
+        """Return cache statistics."""
+        return _cache_info(self.memo)
+
+    def cache_clear(self):
+        """Remove all memoised results."""
+        self.memo.clear()
+
+    def cache_evict(self, *args):
+        """Remove the result memoised for ``args`` if there is one."""
+        try:
+            del self.memo[args]
+        except KeyError:
+            return False
+        return True
+
+
+def memoize(obj=None, maxsize=None, ttl=None, key=None, cache=None,
+            typed=True):
+    """Memoise results of ``obj`` in a :class:`MemoiseCache`.
+
+    It can be used both as ``@memoize`` and ``@memoize(maxsize=100)``.
+    The cache is available as the ``cache`` attribute of the decorated
+    function.
+
+    :param key: function building the cache key from the call arguments.
+        Defaults to the builder returned by :func:`make_key`.
+    :param cache: cache instance to use instead of a new
+        :class:`MemoiseCache`, e.g. a :class:`FileSystemCache`.
+    :param typed: cache arguments of different types separately, see
+        :func:`make_key`.
+    """
+    if obj is None:
+        return functools.partial(memoize, maxsize=maxsize, ttl=ttl, key=key,
+                                 cache=cache, typed=typed)
+
+    if cache is None:
+        cache = MemoiseCache(maxsize=maxsize, ttl=ttl)
+    obj.cache = cache
+    make = key or make_key(obj, typed=typed)
+    flight = SingleFlight()
+
+    def compute(key, args, kwargs):
+        # The previous owner may have stored the value since our miss.
+        value = _peek(cache, key)
+        if value is _MISSING:
+            value = cache[key] = obj(*args, **kwargs)
+        return value
 
+    @functools.wraps(obj)
+    def memoizer(*args, **kwargs):
+        key = make(*args, **kwargs)
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = flight.do(key, compute, key, args, kwargs)
+        return value
+    return _register(memoizer, cache, make)
+
+
+def memoize_async(obj=None, maxsize=None, ttl=None, key=None, cache=None,
+                  typed=True):
+    """Memoise results of the coroutine function ``obj``.
 
-def memoize(obj):
-    cache = obj.cache = {}
+    The decorated function returns an awaitable.  Concurrent calls for the
+    same missing key share a single task, so the coroutine runs only once;
+    failed or cancelled computations are not cached.  Arguments are the
+    same as for :func:`memoize`.  Requires :mod:`asyncio`.
+    """
+    if asyncio is None:
+        raise RuntimeError('memoize_async requires asyncio')
+    if obj is None:
+        return functools.partial(memoize_async, maxsize=maxsize, ttl=ttl,
+                                 key=key, cache=cache, typed=typed)
+
+    if cache is None:
+        cache = MemoiseCache(maxsize=maxsize, ttl=ttl)
+    obj.cache = cache
+    make = key or make_key(obj, typed=typed)
+    # Tasks being computed, per event loop.
+    pending = weakref.WeakKeyDictionary()
+
+    def store(loop, key, task):
+        del pending[loop][key]
+        if not task.cancelled() and task.exception() is None:
+            cache[key] = task.result()
 
     @functools.wraps(obj)
     def memoizer(*args, **kwargs):
-        key = str(args) + str(kwargs)
-        if key not in cache:
-            cache[key] = obj(*args, **kwargs)
-        return cache[key]
+        key = make(*args, **kwargs)
+        # The running loop, or the loop of the thread when called before
+        # the loop runs.
+        loop = asyncio.get_event_loop()
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            future = loop.create_future()
+            future.set_result(value)
+            return future
+        tasks = pending.setdefault(loop, {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(obj(*args, **kwargs),
+                                                      loop=loop)
+            task.add_done_callback(functools.partial(store, loop, key))
+        # Cancelling one caller must not cancel the shared computation.
+        return asyncio.shield(task)
+    return _register(memoizer, cache, make)
+
+
+def _cache_info(cache):
+    """Return :data:`CacheInfo` of ``cache``, which may be any mapping."""
+    if isinstance(cache, CacheBackend):
+        return cache.info()
+    return CacheInfo(None, None, None, None, len(cache), None)
+
+
+def _register(memoizer, cache, make):
+    """Attach the introspection API to ``memoizer`` and register it."""
+    def cache_evict(*args, **kwargs):
+        """Remove the result memoised for given arguments if there is one."""
+        try:
+            del cache[make(*args, **kwargs)]
+        except KeyError:
+            return False
+        return True
+
+    memoizer.cache = cache
+    memoizer.cache_key = make
+    memoizer.cache_info = functools.partial(_cache_info, cache)
+    memoizer.cache_clear = cache.clear
+    memoizer.cache_evict = cache_evict
+    _registry.add(memoizer)
     return memoizer
+
+
+def memoise_report():
+    """Return statistics of all memoised callables in this process.
+
+    The result is a list of dictionaries with the ``name`` of the memoised
+    function and the fields of its :data:`CacheInfo`, sorted by ``nbytes``
+    with the largest caches first.
+    """
+    report = []
+    for memoised in list(_registry):
+        function = getattr(memoised, 'function', memoised)
+        info = memoised.cache_info()._asdict()
+        info['name'] = '{0}.{1}'.format(
+            getattr(function, '__module__', None),
+            getattr(function, '__name__', repr(function)))
+        report.append(dict(info))
+    return sorted(report, key=lambda item: item['nbytes'] or 0, reverse=True)
@@ -15,24 +15,111 @@
 # You should have received a copy of the GNU General Public License
 # along with Invenio; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
-"""Implements custom serializers."""
+"""Implements custom serializers.
 
+Besides the fixed combinations (:class:`ZlibMarshal`, :class:`ZlibPickle`
+and :class:`LzmaPickle`) any registered serializer can be combined with any
+registered compression codec via :class:`Serializer`:
+
+.. code-block:: python
+
+    fast = Serializer('pickle', 'zlib', level=1)
+    small = Serializer('pickle', 'lzma', level=9)
+    blob = small.dumps(record)
+    assert fast.loads(blob) == record
+
+Blobs written by :class:`Serializer` start with a small header naming the
+serializer and codec, so they can be read back whatever codec the reader
+itself uses.  A reader only restores blobs of its own serialization format
+(or of the formats listed in its ``accept`` argument) and raises
+:exc:`SerializerError` for any other, so for example a marshal or JSON
+reader never unpickles data.
+
+Small blobs sharing the same keys compress much better with a preset
+dictionary trained on sample data:
+
+.. code-block:: python
+
+    zdict = train_dictionary(pickle.dumps(r, 2) for r in sample_records)
+    serializer = Serializer('pickle', 'zlib', dictionary=zdict)
+
+The dictionary identifier is stored in the header; dictionaries have to
+be registered (see :func:`register_dictionary`) before reading blobs in
+other processes.
+
+Large batches can be processed on several cores with :func:`dumps_many`
+and :func:`loads_many`.
+"""
+
+from __future__ import absolute_import
+
+import bz2
+import functools
+import heapq
+import json
+import multiprocessing
+import struct
+import threading
 import zlib
+from collections import Counter, namedtuple
+from multiprocessing.pool import ThreadPool
 
 import marshal
+import six
 from backports import lzma
 from six.moves import cPickle as pickle
 
+from ._pool import ordered_map
+
 __all__ = ['ZlibMarshal',
            'ZlibPickle',
            'LzmaPickle',
            'SerializerError',
+           'Serializer',
+           'register_serializer',
+           'register_codec',
+           'PresetDictionary',
+           'register_dictionary',
+           'train_dictionary',
+           'dumps_many',
+           'loads_many',
+           'CHUNK_SIZE',
+           'PICKLE_PROTOCOL',
            'serialize_via_marshal',
            'deserialize_via_marshal',
            'serialize_via_pickle',
            'deserialize_via_pickle']
 
 
+CHUNK_SIZE = 64 * 1024
+"""Size of chunks passed to the compressor by streaming serializers."""
+
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+"""Default pickle protocol; blobs of any protocol can be loaded.
+
+Lower it if the blobs must be readable by older Python versions.
+"""
+
+
+if six.PY2:
+    def _as_buffer(data, offset=0):
+        """Return read-only view of ``data`` from ``offset`` without copying.
+
+        The Python 2 versions of zlib and marshal only accept strings and
+        ``buffer`` objects.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if offset or isinstance(data, bytearray):
+            return buffer(data, offset)  # noqa
+        return data
+else:
+    def _as_buffer(data, offset=0):
+        """Return read-only view of ``data`` from ``offset`` without copying.
+        """
+        return memoryview(data)[offset:] if offset else data
+
+
 class SerializerError(Exception):
 
     """Error during (de-)serialization."""
@@ -40,6 +127,91 @@ class SerializerError(Exception):
     pass
 
 
+class _CompressedWriter(object):
+
+    """File-like object compressing everything written into ``fileobj``."""
+
+    def __init__(self, fileobj, compressor, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        """Buffer ``data`` and compress it once a full chunk is available."""
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= self.chunk_size:
+            self._compress_chunks()
+
+    def _compress_chunks(self):
+        if self._chunks:
+            self.fileobj.write(
+                self.compressor.compress(b''.join(self._chunks)))
+            self._chunks = []
+            self._size = 0
+
+    def close(self):
+        """Write remaining data and finish the compressed stream."""
+        self._compress_chunks()
+        self.fileobj.write(self.compressor.flush())
+
+
+class _DecompressedReader(object):
+
+    """File-like object decompressing data read from ``fileobj``.
+
+    ``prefix`` is compressed data already consumed from ``fileobj``.
+    """
+
+    def __init__(self, fileobj, decompressor, chunk_size=CHUNK_SIZE,
+                 prefix=b''):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.chunk_size = chunk_size
+        self._buffer = decompressor.decompress(prefix) if prefix else b''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        """Make sure ``size`` bytes (everything if ``None``) are buffered."""
+        chunks = [self._buffer[self._pos:]]
+        available = len(chunks[0])
+        while (size is None or available < size) and not self._eof:
+            data = self.fileobj.read(self.chunk_size)
+            if data:
+                data = self.decompressor.decompress(data)
+            else:
+                self._eof = True
+                flush = getattr(self.decompressor, 'flush', None)
+                data = flush() if flush is not None else b''
+            chunks.append(data)
+            available += len(data)
+        self._buffer = b''.join(chunks)
+        self._pos = 0
+
+    def read(self, size=-1):
+        """Return up to ``size`` decompressed bytes."""
+        if size is None or size < 0:
+            self._fill()
+            size = len(self._buffer)
+        elif len(self._buffer) - self._pos < size:
+            self._fill(size)
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        """Return decompressed bytes up to and including a newline."""
+        while True:
+            end = self._buffer.find(b'\n', self._pos)
+            if end >= 0 or self._eof:
+                break
+            self._fill(len(self._buffer) - self._pos + self.chunk_size)
+        return self.read(end + 1 - self._pos if end >= 0 else -1)
+
+
 class ZlibMarshal(object):
 
     """Combines zlib and marshal libraries."""
@@ -47,8 +219,10 @@ class ZlibMarshal(object):
     @staticmethod
     def loads(astring):
         """Decompress and deserialize string into Python object via marshal."""
+        if astring[:len(MAGIC)] == MAGIC:
+            return _readers['ZlibMarshal'].loads(astring)
         try:
-            return marshal.loads(zlib.decompress(astring))
+            return marshal.loads(zlib.decompress(_as_buffer(astring)))
         except zlib.error as e:
             raise SerializerError(
                 'Cannot decompress object ("{}")'.format(str(e))
@@ -76,8 +250,10 @@ class ZlibPickle(object):
     @staticmethod
     def loads(astring):
         """Decompress and deserialize string into Python object via pickle."""
+        if astring[:len(MAGIC)] == MAGIC:
+            return _readers['ZlibPickle'].loads(astring)
         try:
-            return pickle.loads(zlib.decompress(astring))
+            return pickle.loads(zlib.decompress(_as_buffer(astring)))
         except zlib.error as e:
             raise SerializerError(
                 'Cannot decompress object ("{}")'.format(str(e))
@@ -88,9 +264,31 @@ class ZlibPickle(object):
             )
 
     @staticmethod
-    def dumps(obj):
-        """Serialize Python object via pickle into compressed string."""
-        return zlib.compress(pickle.dumps(obj))
+    def dumps(obj, protocol=None):
+        """Serialize Python object via pickle into compressed string.
+
+        :param protocol: pickle protocol, defaults to :data:`PICKLE_PROTOCOL`.
+        """
+        return zlib.compress(_pickle_dumps(obj, protocol))
+
+    @staticmethod
+    def load(fileobj, chunk_size=CHUNK_SIZE):
+        """Read compressed pickle stream from ``fileobj`` into an object.
+
+        Like :meth:`loads` it also reads pickle streams with header.
+        """
+        return _readers['ZlibPickle'].load(fileobj, chunk_size)
+
+    @staticmethod
+    def dump(obj, fileobj, chunk_size=CHUNK_SIZE, protocol=None):
+        """Serialize Python object via pickle into compressed ``fileobj``.
+
+        The pickle is compressed in chunks of ``chunk_size`` bytes as it is
+        produced, so the output is never held in memory as a whole.
+        """
+        writer = _CompressedWriter(fileobj, zlib.compressobj(), chunk_size)
+        _pickle_dump(obj, writer, protocol)
+        writer.close()
 
 # Provides legacy API functions.
 serialize_via_pickle = ZlibPickle.dumps
@@ -104,8 +302,10 @@ class LzmaPickle(object):
     @staticmethod
     def loads(astring):
         """Decompress and deserialize string into a Python object via pickle."""
+        if astring[:len(MAGIC)] == MAGIC:
+            return _readers['LzmaPickle'].loads(astring)
         try:
-            return pickle.loads(lzma.decompress(astring))
+            return pickle.loads(lzma.decompress(_as_buffer(astring)))
         except lzma.LZMAError as e:
             raise SerializerError(
                 'Cannot decompress object ("{}")'.format(str(e))
@@ -116,6 +316,507 @@ class LzmaPickle(object):
             )
 
     @staticmethod
-    def dumps(obj):
-        """Serialize Python object via pickle into a compressed string."""
-        return lzma.compress(pickle.dumps(obj))
+    def dumps(obj, protocol=None):
+        """Serialize Python object via pickle into a compressed string.
+
+        :param protocol: pickle protocol, defaults to :data:`PICKLE_PROTOCOL`.
+        """
+        return lzma.compress(_pickle_dumps(obj, protocol))
+
+    @staticmethod
+    def load(fileobj, chunk_size=CHUNK_SIZE):
+        """Read compressed pickle stream from ``fileobj`` into an object.
+
+        Like :meth:`loads` it also reads pickle streams with header.
+        """
+        return _readers['LzmaPickle'].load(fileobj, chunk_size)
+
+    @staticmethod
+    def dump(obj, fileobj, chunk_size=CHUNK_SIZE, protocol=None):
+        """Serialize Python object via pickle into compressed ``fileobj``.
+
+        The pickle is compressed in chunks of ``chunk_size`` bytes as it is
+        produced, so the output is never held in memory as a whole.
+        """
+        writer = _CompressedWriter(fileobj, lzma.LZMACompressor(),
+                                   chunk_size)
+        _pickle_dump(obj, writer, protocol)
+        writer.close()
+
+
+MAGIC = b'\x00IU'
+"""Prefix of blobs written by :class:`Serializer`."""
+
+FORMAT_VERSION = 1
+
+SerializerFormat = namedtuple('SerializerFormat',
+                              'name ident dumps loads dump load')
+Codec = namedtuple('Codec', 'name ident compressor decompressor errors')
+
+_serializers = {}
+_codecs = {}
+
+
+def _stream_dump(dumps):
+    def dump(obj, fileobj, protocol=None):
+        fileobj.write(dumps(obj, protocol))
+    return dump
+
+
+def _stream_load(loads):
+    def load(fileobj):
+        return loads(fileobj.read())
+    return load
+
+
+def register_serializer(name, ident, dumps, loads, dump=None, load=None):
+    """Register serialization format ``name``.
+
+    :param ident: unique number (0-255) stored in blob headers.
+    :param dumps: function ``(obj, protocol)`` returning a byte string;
+        ``protocol`` is ``None`` unless requested by the caller.
+    :param loads: function restoring the object from a byte string.
+    :param dump: optional streaming variant ``(obj, fileobj, protocol)``.
+    :param load: optional streaming variant ``(fileobj)``.
+    """
+    entry = SerializerFormat(name, ident, dumps, loads,
+                             dump or _stream_dump(dumps),
+                             load or _stream_load(loads))
+    _serializers[name] = _serializers[ident] = entry
+
+
+def register_codec(name, ident, compressor, decompressor, errors=()):
+    """Register compression codec ``name``.
+
+    :param ident: unique number (0-255) stored in blob headers.
+    :param compressor: function ``(level)`` returning an object with
+        ``compress(data)`` and ``flush()`` methods; ``level`` is ``None``
+        for the codec default.
+    :param decompressor: function returning an object with a
+        ``decompress(data)`` method.
+    :param errors: exception classes raised on corrupted input.
+    """
+    _codecs[name] = _codecs[ident] = Codec(name, ident, compressor,
+                                           decompressor, tuple(errors))
+
+
+class _NullCodec(object):
+
+    """Pass-through (de)compressor."""
+
+    @staticmethod
+    def compress(data):
+        return data
+
+    @staticmethod
+    def decompress(data):
+        return bytes(data)
+
+    @staticmethod
+    def flush():
+        return b''
+
+
+def _pickle_dumps(obj, protocol=None):
+    return pickle.dumps(obj,
+                        PICKLE_PROTOCOL if protocol is None else protocol)
+
+
+def _pickle_dump(obj, fileobj, protocol=None):
+    pickle.dump(obj, fileobj,
+                PICKLE_PROTOCOL if protocol is None else protocol)
+
+
+def _json_dumps(obj, protocol=None):
+    data = json.dumps(obj, separators=(',', ':'))
+    return data if isinstance(data, bytes) else data.encode('utf-8')
+
+
+register_serializer(
+    'marshal', 1,
+    lambda obj, protocol=None: marshal.dumps(
+        obj, marshal.version if protocol is None else protocol),
+    marshal.loads)
+register_serializer(
+    'pickle', 2, _pickle_dumps, pickle.loads, _pickle_dump, pickle.load)
+register_serializer(
+    'json', 3, _json_dumps,
+    lambda data: json.loads(data.decode('utf-8')))
+
+register_codec(
+    'none', 0, lambda level=None: _NullCodec, lambda: _NullCodec)
+register_codec(
+    'zlib', 1,
+    lambda level=None: zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION if level is None else level),
+    zlib.decompressobj, (zlib.error, ))
+register_codec(
+    'lzma', 2,
+    lambda level=None: lzma.LZMACompressor(preset=level),
+    lzma.LZMADecompressor, (lzma.LZMAError, ))
+register_codec(
+    'bz2', 3,
+    lambda level=None: bz2.BZ2Compressor(9 if level is None else level),
+    bz2.BZ2Decompressor, (IOError, ValueError))
+
+
+ZDICT_SIZE = 32 * 1024
+"""Maximum useful size of a preset dictionary (the zlib window size)."""
+
+_dictionaries = {}
+
+
+class PresetDictionary(object):
+
+    """Preset dictionary for the zlib codec.
+
+    The dictionary is compressed once and the primed (de)compressor states
+    are copied for every blob, which also saves the compressor setup cost.
+    This works with every zlib version, including Python 2 which lacks the
+    ``zdict`` argument.
+    """
+
+    def __init__(self, data):
+        """Initialise."""
+        self.data = bytes(data[-ZDICT_SIZE:])
+        self.ident = zlib.crc32(self.data) & 0xffffffff
+        self._compressors = {}
+        self._decompressor = None
+        self._lock = threading.Lock()
+
+    def _prime(self, level):
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+        prefix = compressor.compress(self.data) + \
+            compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compressor, prefix
+
+    def compressor(self, level=None):
+        """Return zlib compressor with the dictionary in its window."""
+        with self._lock:
+            if level not in self._compressors:
+                self._compressors[level] = self._prime(level)[0]
+            return self._compressors[level].copy()
+
+    def decompressor(self):
+        """Return zlib decompressor with the dictionary in its window."""
+        with self._lock:
+            if self._decompressor is None:
+                decompressor = zlib.decompressobj()
+                decompressor.decompress(self._prime(None)[1])
+                self._decompressor = decompressor
+            return self._decompressor.copy()
+
+
+def register_dictionary(data):
+    """Register preset dictionary ``data`` and return it.
+
+    All dictionaries used by blobs in a storage must be registered before
+    those blobs are read.
+    """
+    dictionary = PresetDictionary(data)
+    return _dictionaries.setdefault(dictionary.ident, dictionary)
+
+
+def train_dictionary(samples, size=ZDICT_SIZE, ngram=8, segment=64):
+    """Build a preset dictionary from serialized ``samples``.
+
+    Segments of the samples are scored by how many samples share the byte
+    n-grams they contain and picked greedily until ``size`` is reached; the
+    most valuable segments end up at the end of the dictionary, where zlib
+    references them most cheaply.
+
+    :param samples: iterable of byte strings, e.g. pickled records.
+    :param size: maximum size of the dictionary in bytes.
+    :param ngram: length of the byte sequences counted.
+    :param segment: length of the segments copied into the dictionary.
+    """
+    samples = [bytes(sample) for sample in samples]
+    frequency = Counter()
+    for sample in samples:
+        frequency.update(set(sample[i:i + ngram]
+                             for i in range(len(sample) - ngram + 1)))
+
+    def grams(chunk):
+        return set(chunk[i:i + ngram]
+                   for i in range(len(chunk) - ngram + 1))
+
+    def score(chunk):
+        return sum(frequency[gram] for gram in grams(chunk)
+                   if frequency[gram] > 1)
+
+    heap = []
+    for sample in samples:
+        for offset in range(0, max(len(sample) - ngram, 1), segment // 2):
+            chunk = sample[offset:offset + segment]
+            heap.append((-score(chunk), chunk))
+    heapq.heapify(heap)
+
+    selected, total = [], 0
+    while heap and total < size:
+        dummy, chunk = heapq.heappop(heap)
+        current = score(chunk)
+        if heap and current < -heap[0][0]:
+            # Score dropped because of already selected n-grams; retry later.
+            heapq.heappush(heap, (-current, chunk))
+            continue
+        if not current:
+            break
+        selected.append(chunk)
+        total += len(chunk)
+        for gram in grams(chunk):
+            frequency[gram] = 0
+    return b''.join(reversed(selected))[-size:]
+
+
+class Serializer(object):
+
+    """Combine a registered serializer with a registered codec.
+
+    :param serializer: name of the serialization format (``marshal``,
+        ``pickle``, ``json`` or a custom registered one).
+    :param codec: name of the compression codec (``none``, ``zlib``,
+        ``lzma``, ``bz2`` or a custom registered one).
+    :param level: compression level (zlib level, lzma preset or bz2
+        compresslevel); ``None`` for the codec default.
+    :param protocol: pickle protocol (defaults to :data:`PICKLE_PROTOCOL`)
+        or marshal version.
+    :param header: write the self-describing header; disable only to
+        produce blobs readable by the fixed combinations of older releases.
+    :param dictionary: preset dictionary (bytes, e.g. from
+        :func:`train_dictionary`) for the ``zlib`` codec; it is registered
+        automatically.
+    :param accept: names of further serialization formats restored from
+        blobs with header; blobs of other formats raise
+        :exc:`SerializerError`.  Only list formats whose data is trusted,
+        e.g. never accept ``pickle`` from untrusted sources.
+
+    Blobs without header are read with this instance's own serializer and
+    codec, so existing data does not need to be migrated.  Blobs with
+    header may use any registered codec.
+    """
+
+    def __init__(self, serializer='pickle', codec='zlib', level=None,
+                 protocol=None, header=True, dictionary=None, accept=()):
+        """Initialise."""
+        try:
+            self.serializer = _serializers[serializer]
+            self.codec = _codecs[codec]
+            accept = [_serializers[name].name for name in accept]
+        except KeyError as e:
+            raise SerializerError('Unknown serializer or codec {0}'.format(e))
+        self.accept = frozenset(accept) | set([self.serializer.name])
+        self.level = level
+        self.protocol = protocol
+        self.header = header
+        self.dictionary = None
+        if dictionary is not None:
+            if self.codec.name != 'zlib':
+                raise SerializerError(
+                    'Preset dictionaries require the zlib codec')
+            self.dictionary = register_dictionary(dictionary)
+
+    def __reduce__(self):
+        """Pickle by configuration so instances can be sent to processes."""
+        dictionary = self.dictionary.data if self.dictionary else None
+        return (Serializer, (self.serializer.name, self.codec.name,
+                             self.level, self.protocol, self.header,
+                             dictionary, tuple(self.accept)))
+
+    def _params(self):
+        """Return codec parameters stored in the header."""
+        if self.dictionary is None:
+            return b''
+        return struct.pack('>I', self.dictionary.ident)
+
+    def _header(self):
+        if not self.header:
+            return b''
+        params = self._params()
+        return MAGIC + bytes(bytearray([
+            FORMAT_VERSION, self.serializer.ident, self.codec.ident,
+            len(params)])) + params
+
+    def _compressor(self):
+        if self.dictionary is not None:
+            return self.dictionary.compressor(self.level)
+        return self.codec.compressor(self.level)
+
+    def _decompressor(self, codec, params):
+        """Return decompressor for ``codec`` with header ``params``."""
+        if not params:
+            return codec.decompressor()
+        try:
+            ident, = struct.unpack('>I', bytes(params))
+            return _dictionaries[ident].decompressor()
+        except (struct.error, KeyError):
+            raise SerializerError(
+                'Unknown compression dictionary {0!r}'.format(bytes(params)))
+
+    def _parse_header(self, head):
+        """Return serializer, codec and params length of a fixed header."""
+        if len(head) != len(MAGIC) + 4:
+            raise SerializerError('Truncated blob header')
+        version, serializer, codec, length = bytearray(head[len(MAGIC):])
+        if version != FORMAT_VERSION:
+            raise SerializerError(
+                'Unsupported blob format version {0}'.format(version))
+        try:
+            serializer, codec = _serializers[serializer], _codecs[codec]
+        except KeyError as e:
+            raise SerializerError('Unknown serializer or codec {0}'.format(e))
+        if serializer.name not in self.accept:
+            raise SerializerError(
+                'Serialization format {0} is not accepted'.format(
+                    serializer.name))
+        return serializer, codec, length
+
+    def _restore(self, serializer, codec, load):
+        try:
+            return load()
+        except codec.errors as e:
+            raise SerializerError(
+                'Cannot decompress object ("{}")'.format(str(e))
+            )
+        except SerializerError:
+            raise
+        except Exception as e:
+            raise SerializerError(
+                'Cannot restore object ("{}")'.format(str(e))
+            )
+
+    def dumps(self, obj, into=None):
+        """Serialize and compress ``obj`` into a string.
+
+        :param into: optional ``bytearray`` the blob is appended to instead
+            of building a new string; it is returned.
+        """
+        compressor = self._compressor()
+        data = self.serializer.dumps(obj, self.protocol)
+        if into is None:
+            return self._header() + compressor.compress(data) + \
+                compressor.flush()
+        into += self._header()
+        into += compressor.compress(data)
+        into += compressor.flush()
+        return into
+
+    def loads(self, astring):
+        """Decompress and deserialize string into Python object.
+
+        ``astring`` can be any bytes-like object, e.g. a ``bytearray`` or a
+        ``memoryview`` slice of a larger buffer.
+        """
+        serializer, codec, offset = self.serializer, self.codec, 0
+        params = self._params()
+        if astring[:len(MAGIC)] == MAGIC:
+            size = len(MAGIC) + 4
+            serializer, codec, length = self._parse_header(astring[:size])
+            params = astring[size:size + length]
+            offset = size + length
+
+        def load():
+            decompressor = self._decompressor(codec, params)
+            data = decompressor.decompress(_as_buffer(astring, offset))
+            flush = getattr(decompressor, 'flush', None)
+            if flush is not None:
+                data += flush()
+            return serializer.loads(data)
+        return self._restore(serializer, codec, load)
+
+    def dump(self, obj, fileobj, chunk_size=CHUNK_SIZE):
+        """Serialize ``obj`` into compressed ``fileobj`` in chunks."""
+        fileobj.write(self._header())
+        writer = _CompressedWriter(fileobj, self._compressor(), chunk_size)
+        self.serializer.dump(obj, writer, self.protocol)
+        writer.close()
+
+    def load(self, fileobj, chunk_size=CHUNK_SIZE):
+        """Read compressed stream from ``fileobj`` into an object."""
+        serializer, codec = self.serializer, self.codec
+        params = self._params()
+        head = fileobj.read(len(MAGIC) + 4)
+        if head[:len(MAGIC)] == MAGIC:
+            serializer, codec, length = self._parse_header(head)
+            params = fileobj.read(length)
+            head = b''
+
+        def load():
+            reader = _DecompressedReader(
+                fileobj, self._decompressor(codec, params), chunk_size,
+                prefix=head)
+            return serializer.load(reader)
+        return self._restore(serializer, codec, load)
+
+
+# Readers used by the fixed combinations for blobs with header.
+_readers = {
+    'ZlibMarshal': Serializer('marshal', 'zlib'),
+    'ZlibPickle': Serializer('pickle', 'zlib'),
+    'LzmaPickle': Serializer('pickle', 'lzma'),
+}
+
+
+_worker_serializer = None
+
+
+def _init_worker(serializer, dictionaries):
+    """Set up a worker process.
+
+    Registered dictionaries are passed explicitly, as processes which are
+    spawned instead of forked start with an empty registry.
+    """
+    global _worker_serializer
+    for data in dictionaries:
+        register_dictionary(data)
+    _worker_serializer = serializer
+
+
+def _worker_call(method, item):
+    return getattr(_worker_serializer, method)(item)
+
+
+def _map(method, items, serializer, workers, processes, chunksize):
+    """Apply ``serializer.<method>`` to ``items`` in a pool, in order."""
+    workers = workers or multiprocessing.cpu_count()
+    if processes:
+        context = processes if hasattr(processes, 'Pool') else multiprocessing
+        dictionaries = [dictionary.data
+                        for dictionary in list(_dictionaries.values())]
+        make_pool = functools.partial(context.Pool, workers, _init_worker,
+                                      (serializer, dictionaries))
+        function = functools.partial(_worker_call, method)
+    else:
+        make_pool = functools.partial(ThreadPool, workers)
+        function = getattr(serializer, method)
+    return ordered_map(make_pool, function, items, chunksize, workers * 4)
+
+
+def dumps_many(objs, serializer=ZlibPickle, workers=None, processes=False,
+               chunksize=16):
+    """Serialize ``objs`` in parallel and yield the blobs in order.
+
+    zlib, lzma and bz2 release the GIL while compressing, so threads scale
+    for compression-heavy serializers; use ``processes=True`` when
+    serialization itself dominates.
+
+    :param objs: iterable of objects.
+    :param serializer: object with ``dumps``, e.g. :class:`ZlibPickle` or a
+        :class:`Serializer` instance; it must be picklable for processes.
+    :param workers: number of workers, defaults to the number of CPUs.
+    :param processes: use a process pool instead of a thread pool; a
+        multiprocessing context, e.g. ``get_context('spawn')``, selects the
+        start method.
+    :param chunksize: number of items sent to a worker at once.
+    """
+    return _map('dumps', objs, serializer, workers, processes, chunksize)
+
+
+def loads_many(blobs, serializer=ZlibPickle, workers=None, processes=False,
+               chunksize=16):
+    """Deserialize ``blobs`` in parallel and yield the objects in order.
+
+    Arguments are the same as for :func:`dumps_many`, ``serializer`` must
+    provide ``loads``.
+    """
+    return _map('loads', blobs, serializer, workers, processes, chunksize)
@@ -21,15 +21,25 @@
 
 from __future__ import print_function
 
+import functools
+import marshal
+import multiprocessing
+import os
+import platform
 import re
 import sys
 import textwrap
+import threading
+import unicodedata
 
 import pkg_resources
 import six
 from six.moves import html_entities
 from unidecode import unidecode
 
+from ._pool import ordered_map
+from .hash import sha1
+
 __revision__ = "$Id$"
 
 
@@ -41,6 +51,8 @@ except ImportError:
 
 
 CFG_LATEX_UNICODE_TRANSLATION_CONST = {}
+_LATEX_UNICODE_LOCK = threading.RLock()
+_LATEX_UNICODE_CACHE_VERSION = 1
 
 CFG_WRAP_TEXT_IN_A_BOX_STYLES = {
     '__DEFAULT': {
@@ -140,6 +152,58 @@ re_latex_uppercase_y = re.compile("\\\\[\"']\\{?Y\\}?")
 re_latex_uppercase_c = re.compile("\\\\['uc]\\{?C\\}?")
 re_latex_uppercase_n = re.compile("\\\\[c'~^vu]\\{?N\\}?")
 
+# Accent commands accepted for each letter by strip_accents.
+_LATEX_ACCENTS = dict(
+    [(letter, "\"H'`~^vu=k") for letter in "aeiouAEIOU"] +
+    [(letter, "\"'") for letter in "yY"] +
+    [(letter, "'uc") for letter in "cC"] +
+    [(letter, "c'~^vu") for letter in "nN"])
+re_latex_accent = re.compile(
+    "\\\\(?:([\"H'`~^vu=kc])\\{?([aeiouyAEIOUYcCnN])\\}?|"
+    "(ae|oe)\\{\\}?|(AE|OE)\\{?\\}?)")
+
+# Characters without a canonical decomposition into a base letter.
+_ACCENTS_SPECIAL = {
+    u'æ': u'ae', u'Æ': u'AE', u'œ': u'oe', u'Œ': u'OE', u'ß': u'ss',
+    u'ø': u'o', u'Ø': u'O', u'đ': u'd', u'Đ': u'D', u'ł': u'l', u'Ł': u'L',
+    u'ı': u'i',
+}
+# Latin-1 Supplement, Latin Extended A and B, Greek and Latin Extended
+# Additional.
+_ACCENTS_RANGES = ((0xc0, 0x250), (0x370, 0x400), (0x1e00, 0x1f00))
+
+
+def _accent_base(char):
+    """Return ``char`` without its accents following the Unicode data."""
+    decomposition = unicodedata.decomposition(char).split()
+    if not decomposition or decomposition[0].startswith('<'):
+        return char
+    marks = [unichr(int(code, 16)) for code in decomposition[1:]]
+    if not all(unicodedata.combining(mark) for mark in marks):
+        return char
+    return _accent_base(unichr(int(decomposition[0], 16)))
+
+
+def _build_accents_table():
+    """Return ``unicode.translate`` table stripping accents."""
+    table = {}
+    for start, end in _ACCENTS_RANGES:
+        for code in range(start, end):
+            base = _accent_base(unichr(code))
+            # Accented ligatures and letters, e.g. ǽ or ǿ.
+            base = _ACCENTS_SPECIAL.get(base, base)
+            if base != unichr(code):
+                table[code] = base
+    # Drop combining diacritical marks, e.g. in decomposed text.
+    for code in range(0x300, 0x370):
+        table[code] = None
+    for char, replacement in six.iteritems(_ACCENTS_SPECIAL):
+        table[ord(char)] = replacement
+    return table
+
+
+_ACCENTS_TABLE = _build_accents_table()
+
 
 def get_kb_filename(filename='latex-to-unicode.kb'):
     """Get kb filename."""
@@ -559,8 +623,8 @@ def translate_latex2unicode(text, kb_file=None):
     CFG_ETCDIR/bibconvert/KB/latex-to-unicode.kb.
     The translated Unicode string will then be returned.
 
-    If the translation table and compiled regular expression object is not
-    previously generated in the current session, they will be.
+    If the translation table and longest-match trie are not previously
+    loaded in the current session, they will be.
 
     :param text: a text presumably containing LaTeX symbols.
     :type text: string
@@ -580,58 +644,274 @@ def translate_latex2unicode(text, kb_file=None):
     except UnicodeDecodeError:
         text = unicode(wash_for_utf8(text))
     # Load translation table, if required
-    if CFG_LATEX_UNICODE_TRANSLATION_CONST == {}:
+    if 'trie' not in CFG_LATEX_UNICODE_TRANSLATION_CONST:
+        with _LATEX_UNICODE_LOCK:
+            if 'trie' not in CFG_LATEX_UNICODE_TRANSLATION_CONST:
+                _load_latex2unicode_constants(kb_file)
+    # Replace all symbols in a single pass. If LaTeX style markers {, } and
+    # $ are before or after the matching text, they are replaced as well.
+    trie = CFG_LATEX_UNICODE_TRANSLATION_CONST['trie']
+    length = len(text)
+    search = CFG_LATEX_UNICODE_TRANSLATION_CONST['start_obj'].search
+    result = []
+    position = 0
+    match = search(text)
+    while match is not None:
+        start = match.start()
+        # Symbols which include a leading marker, e.g. ``$\le$``, win over
+        # a shorter symbol following the marker.
+        found = _latex2unicode_longest(trie, text, start, length)
+        if found is None and text[start] in u'{$':
+            found = _latex2unicode_longest(trie, text, start + 1, length)
+        if found is None:
+            match = search(text, start + 1)
+            continue
+        end, value = found
+        if end < length and text[end] in u'}$':
+            end += 1
+        result.append(text[position:start])
+        result.append(value)
+        position = end
+        match = search(text, end)
+    result.append(text[position:])
+    return u''.join(result)
+
+
+def _init_latex2unicode_worker(kb_file):
+    """Load the KB once per worker unless inherited from the parent."""
+    if 'trie' not in CFG_LATEX_UNICODE_TRANSLATION_CONST:
         _load_latex2unicode_constants(kb_file)
-    # Find all matches and replace text
-    for match in CFG_LATEX_UNICODE_TRANSLATION_CONST['regexp_obj'] \
-            .finditer(text):
-        # If LaTeX style markers {, } and $ are before or after the
-        # matching text, it will replace those as well
-        text = re.sub("[\{\$]?%s[\}\$]?" % (re.escape(match.group()),),
-                      CFG_LATEX_UNICODE_TRANSLATION_CONST[
-                          'table'][match.group()],
-                      text)
-    # Return Unicode representation of translated text
-    return text
+
+
+def translate_latex2unicode_many(texts, kb_file=None, workers=None,
+                                 chunksize=64):
+    """Translate many LaTeX texts to unicode and yield them in order.
+
+    All texts share one loaded KB. With more than one worker the texts are
+    sent in chunks to a process pool, so that e.g. reindexing the titles
+    and abstracts of a whole collection scales with the number of cores.
+
+    :param texts: iterable of texts presumably containing LaTeX symbols.
+    :type texts: iterable
+
+    :param kb_file: full path to file containing latex2unicode translations.
+                    Defaults to CFG_ETCDIR/bibconvert/KB/latex-to-unicode.kb
+    :type kb_file: string
+
+    :param workers: number of worker processes; ``None`` or ``1`` translate
+        in the current process, ``0`` uses one process per CPU.
+    :type workers: int
+
+    :param chunksize: number of texts sent to a worker at once.
+    :type chunksize: int
+
+    :return: generator of translated texts
+    :rtype: generator
+    """
+    if kb_file is None:
+        kb_file = get_kb_filename()
+    # Load in the parent so forked workers inherit the KB.
+    _init_latex2unicode_worker(kb_file)
+    if workers is None or workers == 1:
+        for text in texts:
+            yield translate_latex2unicode(text, kb_file)
+        return
+
+    workers = workers or multiprocessing.cpu_count()
+    make_pool = functools.partial(multiprocessing.Pool, workers,
+                                  _init_latex2unicode_worker, (kb_file, ))
+    for text in ordered_map(make_pool, translate_latex2unicode, texts,
+                            chunksize, workers * 4):
+        yield text
+
+
+def _latex2unicode_trie(table):
+    """Return trie of nested dictionaries built from translation ``table``.
+
+    Each node maps the next character to a child node; the translation of
+    a symbol ending at a node is stored under the empty key.
+    """
+    trie = {}
+    for symbol, translation in six.iteritems(table):
+        node = trie
+        for char in symbol:
+            node = node.setdefault(char, {})
+        node[u''] = translation
+    return trie
+
+
+def _latex2unicode_longest(trie, text, start, length):
+    """Return ``(end, translation)`` of the longest symbol at ``start``."""
+    node = trie
+    found = None
+    while start < length:
+        node = node.get(text[start])
+        if node is None:
+            break
+        start += 1
+        if u'' in node:
+            found = (start, node[u''])
+    return found
+
+
+def _latex2unicode_cache_header(stat, payload):
+    """Return the first line of a compiled KB cache.
+
+    It identifies the interpreter, as marshal data is only readable by the
+    Python version which wrote it, the KB the cache was compiled from and
+    the checksum of the marshalled data.
+    """
+    return ('latex2unicode %d %s %d.%d %d %r %d %s\n' % (
+        _LATEX_UNICODE_CACHE_VERSION, platform.python_implementation(),
+        sys.version_info[0], sys.version_info[1], marshal.version,
+        stat.st_mtime, stat.st_size, sha1(payload).hexdigest())
+    ).encode('ascii')
+
+
+def _read_latex2unicode_cache(kb_file, stat):
+    """Return table and trie from the compiled cache of ``kb_file``.
+
+    Returns ``None`` unless the cache was written by this interpreter
+    version for the current KB and is intact.
+    """
+    try:
+        with open(kb_file + '.cache', 'rb') as cache:
+            header = cache.readline()
+            payload = cache.read()
+    except (IOError, OSError):
+        return None
+    if header != _latex2unicode_cache_header(stat, payload):
+        return None
+    try:
+        return marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def _parse_latex2unicode_kb(kb_file):
+    """Return translation table and trie parsed from ``kb_file``."""
+    table = {}
+    with open(kb_file) as data:
+        for line in data:
+            # The file has form of latex|--|utf-8. First decode to Unicode.
+            line = line.decode('utf-8')
+            mapping = line.split('|--|')
+            table[mapping[0].rstrip('\n')] = mapping[1].rstrip('\n')
+    return table, _latex2unicode_trie(table)
+
+
+def _read_latex2unicode_kb(kb_file):
+    """Return translation table and trie from KB or its compiled cache.
+
+    The cache (``<kb_file>.cache``) is only read; it is written by
+    :func:`compile_latex2unicode_kb`.  The KB is parsed if the cache is
+    missing, stale or was compiled by another Python version.
+    """
+    stat = os.stat(kb_file)
+    cached = _read_latex2unicode_cache(kb_file, stat)
+    if cached is not None:
+        return cached
+    return _parse_latex2unicode_kb(kb_file)
+
+
+def compile_latex2unicode_kb(kb_file=None):
+    """Write the compiled cache of a LaTeX2Unicode KB ahead of time.
+
+    Run it at build or deploy time, with the Python version serving the
+    application, to spare the first translation in every worker from
+    parsing the KB.  The cache is unmarshalled when loaded, so it must be
+    as trusted as the code itself; it is never written at runtime.
+
+    :param kb_file: full path to file containing latex2unicode translations.
+                    Defaults to CFG_ETCDIR/bibconvert/KB/latex-to-unicode.kb
+    :type kb_file: string
+
+    :return: path of the cache file
+    :rtype: string
+    """
+    if kb_file is None:
+        kb_file = get_kb_filename()
+    cache_file = kb_file + '.cache'
+    stat = os.stat(kb_file)
+    payload = marshal.dumps(_parse_latex2unicode_kb(kb_file))
+    # Replace the cache atomically.
+    tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as cache:
+            cache.write(_latex2unicode_cache_header(stat, payload))
+            cache.write(payload)
+        os.rename(tmp_file, cache_file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+    return cache_file
 
 
 def _load_latex2unicode_constants(kb_file=None):
     """Load LaTeX2Unicode translation table dictionary.
 
-    Load LaTeX2Unicode translation table dictionary and regular
-    expression object from KB to a global dictionary.
+    Load LaTeX2Unicode translation table dictionary and longest-match
+    trie from KB (or its compiled cache) to a global dictionary. Loading
+    is serialized between threads.
 
     :param kb_file: full path to file containing latex2unicode translations.
                     Defaults to CFG_ETCDIR/bibconvert/KB/latex-to-unicode.kb
     :type kb_file: string
 
-    :return: dict of type: {'regexp_obj': regexp match object,
+    :return: dict of type: {'trie': nested dicts of LaTeX symbol characters,
+                            'start_obj': regexp matching possible starts,
                             'table': dict of LaTeX -> Unicode mappings}
     :rtype: dict
     """
     if kb_file is None:
         kb_file = get_kb_filename()
 
-    try:
-        data = open(kb_file)
-    except IOError:
-        # File not found or similar
-        sys.stderr.write(
-            "\nCould not open LaTeX to Unicode KB file. "
-            "Aborting translation.\n")
-        return CFG_LATEX_UNICODE_TRANSLATION_CONST
-    latex_symbols = []
-    translation_table = {}
-    for line in data:
-        # The file has form of latex|--|utf-8. First decode to Unicode.
-        line = line.decode('utf-8')
-        mapping = line.split('|--|')
-        translation_table[mapping[0].rstrip('\n')] = mapping[1].rstrip('\n')
-        latex_symbols.append(re.escape(mapping[0].rstrip('\n')))
-    data.close()
-    CFG_LATEX_UNICODE_TRANSLATION_CONST[
-        'regexp_obj'] = re.compile("|".join(latex_symbols))
-    CFG_LATEX_UNICODE_TRANSLATION_CONST['table'] = translation_table
+    with _LATEX_UNICODE_LOCK:
+        try:
+            translation_table, trie = _read_latex2unicode_kb(kb_file)
+        except (IOError, OSError):
+            # File not found or similar
+            sys.stderr.write(
+                "\nCould not open LaTeX to Unicode KB file. "
+                "Aborting translation.\n")
+            return CFG_LATEX_UNICODE_TRANSLATION_CONST
+        # Characters which can start a symbol or its leading marker.
+        start_chars = set(trie) | set(u'{$')
+        # Readers check for ``trie``, so it is published last.
+        CFG_LATEX_UNICODE_TRANSLATION_CONST['table'] = translation_table
+        CFG_LATEX_UNICODE_TRANSLATION_CONST['start_obj'] = re.compile(
+            u'[%s]' % u''.join(re.escape(char) for char in start_chars))
+        CFG_LATEX_UNICODE_TRANSLATION_CONST['trie'] = trie
+    return CFG_LATEX_UNICODE_TRANSLATION_CONST
+
+
+class _AsciiTransliterations(dict):
+
+    """Per-codepoint cache of ``unidecode`` results for ``translate()``.
+
+    Unrecognized characters are transliterated to an empty string.
+    """
+
+    def __missing__(self, code):
+        ascii_text = six.text_type(unidecode(unichr(code)))
+        if ascii_text == u"[?]":
+            ascii_text = u""
+        self[code] = ascii_text
+        return ascii_text
+
+
+_ascii_transliterations = _AsciiTransliterations(
+    (code, unichr(code)) for code in range(128))
+
+
+def _to_ascii(text):
+    """Transliterate unicode ``text`` to ASCII using the shared cache."""
+    if not isinstance(text, six.text_type):
+        return unidecode(text)
+    return text.translate(_ascii_transliterations)
 
 
 def translate_to_ascii(values):
@@ -661,19 +941,7 @@ def translate_to_ascii(values):
     for index, value in enumerate(values):
         if not value:
             continue
-        unicode_text = decode_to_unicode(value)
-        if u"[?]" in unicode_text:
-            decoded_text = []
-            for unicode_char in unicode_text:
-                decoded_char = unidecode(unicode_char)
-                # Skip unrecognized characters
-                if decoded_char != "[?]":
-                    decoded_text.append(decoded_char)
-            ascii_text = ''.join(decoded_text).encode('ascii')
-        else:
-            ascii_text = unidecode(unicode_text).replace(
-                u"[?]", u"").encode('ascii')
-        values[index] = ascii_text
+        values[index] = _to_ascii(decode_to_unicode(value)).encode('ascii')
     return values
 
 
@@ -716,66 +984,37 @@ def xml_entities_to_utf8(text, skip=('lt', 'gt', 'amp')):
     return re.sub("&#?\w+;", fixup, text)
 
 
+def _strip_latex_accent(match):
+    """Return the letter of a LaTeX accent command matched in a string."""
+    accent, letter, lowercase, uppercase = match.groups()
+    if letter is None:
+        return lowercase or uppercase
+    if accent in _LATEX_ACCENTS[letter]:
+        return letter
+    return match.group()
+
+
 def strip_accents(x):
     u"""Strip accents in the input phrase X.
 
     Strip accents in the input phrase X (assumed in UTF-8) by replacing
     accented characters with their unaccented cousins (e.g. é by e).
+    LaTeX accent commands are handled by one regexp and Unicode characters
+    (Latin, Greek and decomposed combining marks) by one translate table.
 
     :param x: the input phrase to strip.
     :type x: string
 
     :return: Return such a stripped X.
     """
-    x = re_latex_lowercase_a.sub("a", x)
-    x = re_latex_lowercase_ae.sub("ae", x)
-    x = re_latex_lowercase_oe.sub("oe", x)
-    x = re_latex_lowercase_e.sub("e", x)
-    x = re_latex_lowercase_i.sub("i", x)
-    x = re_latex_lowercase_o.sub("o", x)
-    x = re_latex_lowercase_u.sub("u", x)
-    x = re_latex_lowercase_y.sub("x", x)
-    x = re_latex_lowercase_c.sub("c", x)
-    x = re_latex_lowercase_n.sub("n", x)
-    x = re_latex_uppercase_a.sub("A", x)
-    x = re_latex_uppercase_ae.sub("AE", x)
-    x = re_latex_uppercase_oe.sub("OE", x)
-    x = re_latex_uppercase_e.sub("E", x)
-    x = re_latex_uppercase_i.sub("I", x)
-    x = re_latex_uppercase_o.sub("O", x)
-    x = re_latex_uppercase_u.sub("U", x)
-    x = re_latex_uppercase_y.sub("Y", x)
-    x = re_latex_uppercase_c.sub("C", x)
-    x = re_latex_uppercase_n.sub("N", x)
+    x = re_latex_accent.sub(_strip_latex_accent, x)
 
     # convert input into Unicode string:
     try:
         y = unicode(x, "utf-8")
     except Exception:
         return x  # something went wrong, probably the input wasn't UTF-8
-    # asciify Latin-1 lowercase characters:
-    y = re_unicode_lowercase_a.sub("a", y)
-    y = re_unicode_lowercase_ae.sub("ae", y)
-    y = re_unicode_lowercase_oe.sub("oe", y)
-    y = re_unicode_lowercase_e.sub("e", y)
-    y = re_unicode_lowercase_i.sub("i", y)
-    y = re_unicode_lowercase_o.sub("o", y)
-    y = re_unicode_lowercase_u.sub("u", y)
-    y = re_unicode_lowercase_y.sub("y", y)
-    y = re_unicode_lowercase_c.sub("c", y)
-    y = re_unicode_lowercase_n.sub("n", y)
-    y = re_unicode_lowercase_ss.sub("ss", y)
-    # asciify Latin-1 uppercase characters:
-    y = re_unicode_uppercase_a.sub("A", y)
-    y = re_unicode_uppercase_ae.sub("AE", y)
-    y = re_unicode_uppercase_oe.sub("OE", y)
-    y = re_unicode_uppercase_e.sub("E", y)
-    y = re_unicode_uppercase_i.sub("I", y)
-    y = re_unicode_uppercase_o.sub("O", y)
-    y = re_unicode_uppercase_u.sub("U", y)
-    y = re_unicode_uppercase_y.sub("Y", y)
-    y = re_unicode_uppercase_c.sub("C", y)
-    y = re_unicode_uppercase_n.sub("N", y)
+    y = y.translate(_ACCENTS_TABLE)
     # return UTF-8 representation of the Unicode string:
     return y.encode("utf-8")
 
@@ -786,10 +1025,31 @@ def slugify(text, delim=u'-'):
     """Generate an ASCII-only slug."""
     result = []
     for word in _punct_re.split(text.lower()):
-        result.extend(unidecode(word).split())
+        result.extend(_to_ascii(word).split())
     return unicode(delim.join(result))
 
 
+def slugify_many(texts, delim=u'-'):
+    """Generate ASCII-only slugs for a list of texts.
+
+    :param texts: iterable of texts
+    :param delim: delimiter of the words in a slug
+    :return: list of slugs in the same order
+    """
+    split = _punct_re.split
+    table = _ascii_transliterations
+    join = six.text_type(delim).join
+    slugs = []
+    for text in texts:
+        if not isinstance(text, six.text_type):
+            slugs.append(slugify(text, delim))
+            continue
+        # One translate call for all words; the spaces keep them apart.
+        words = u' '.join(split(text.lower())).translate(table)
+        slugs.append(join(words.split()))
+    return slugs
+
+
 def show_diff(original, modified, prefix='', suffix='',
               prefix_unchanged=' ',
               suffix_unchanged='',
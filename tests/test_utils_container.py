@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Unit tests for the container functions.
+"""
+
+import sys
+
+from invenio_testing import InvenioTestCase
+from invenio_utils.container import get_substructure, get_substructures
+
+DATA = {'a': 5, 'b': {'c': [1, 2, [{'f': [57]}], 4], 'd': 'test'}}
+
+
+def recursive_get_substructure(data, path):
+    """Reference implementation: the former recursive version."""
+    if not len(path):
+        return data
+    try:
+        return recursive_get_substructure(data[path[0]], path[1:])
+    except (TypeError, IndexError, KeyError):
+        return None
+
+
+class TestContainerUtils(InvenioTestCase):
+    """
+    container TestSuite.
+    """
+    def test_get_substructure(self):
+        self.assertEqual(get_substructure(DATA, "bc"),
+                         [1, 2, [{'f': [57]}], 4])
+        self.assertEqual(get_substructure(DATA, ['b', 'c', 2, 0, 'f', 0]),
+                         57)
+        self.assertEqual(get_substructure(DATA, ('b', 'd', 1)), 'e')
+        self.assertIs(get_substructure(DATA, []), DATA)
+
+    def test_missing(self):
+        for path in (['x'], ['b', 'x'], ['b', 'c', 9], ['b', 'c', -9],
+                     ['b', 'c', 'x'], ['a', 0], ['b', 'c', 2, 0, 'f', 'd'],
+                     [['unhashable']]):
+            self.assertEqual(get_substructure(DATA, path), None)
+
+    def test_recursive_parity(self):
+        paths = ["", "b", "bc", "bd", "ba", "xy", ['b', 'c', 1],
+                 ['b', 'c', 2, 0, 'f', 0], ['b', 'c', 2, 0, 'f', 1],
+                 ['b', 'd', 0], ['b', 'd', 0, 0], ['a', 'b'],
+                 ['b', 'c', slice(1, 3)]]
+        for path in paths:
+            self.assertEqual(get_substructure(DATA, path),
+                             recursive_get_substructure(DATA, path))
+
+    def test_deep_path(self):
+        depth = sys.getrecursionlimit() * 2
+        data = leaf = []
+        for dummy in range(depth):
+            child = []
+            leaf.append(child)
+            leaf = child
+        leaf.append('leaf')
+        self.assertEqual(get_substructure(data, [0] * depth + [0]), 'leaf')
+        self.assertEqual(get_substructure(data, [0] * (depth + 2)), 'l')
+        self.assertEqual(get_substructure(data, [0] * depth + [1]), None)
+
+    def test_get_substructures(self):
+        datas = [{'a': [1]}, {'a': [2]}, {}, {'a': []}, None]
+        path = iter(['a', 0])
+        self.assertEqual(list(get_substructures(datas, path)),
+                         [1, 2, None, None, None])
+        self.assertEqual(list(get_substructures([], "ab")), [])
@@ -21,13 +21,18 @@
 Test unit for the miscutil/datastructures module.
 """
 
+import pickle
+import threading
+import time
+from collections import MutableMapping
 from operator import delitem, setitem
 
 from werkzeug.datastructures import MultiDict
 
 from invenio_testing import InvenioTestCase
-from invenio_utils.datastructures import DotableDict, LaziestDict, LazyDict, \
-    SmartDict, flatten_multidict
+from invenio_utils.datastructures import CompactDict, DotableDict, \
+    LaziestDict, LazyDict, PersistentSmartDict, SmartDict, compact, \
+    flatten_multidict, flatten_multidicts, iter_flattened, query_records
 
 
 class CallCounter(object):
@@ -202,6 +207,151 @@ class TestLazyDictionaries(InvenioTestCase):
         laziest_dict2 = LaziestDict()
         self.assertFalse('foo2' in laziest_dict2)
 
+    def _run_threads(self, target, count=8):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_lazy_concurrent_evaluation(self):
+        def slow_populate():
+            time.sleep(0.05)
+            return {'foo': 'bar'}
+        populate = CallCounter(slow_populate)
+        lazy_dict = LazyDict(populate)
+
+        self._run_threads(lambda: lazy_dict['foo'])
+        self.assertEqual(populate.counter, 1)
+
+    def test_laziest_concurrent_evaluation(self):
+        def slow_populate(key):
+            time.sleep(0.05)
+            return key * 2
+        populate = CallCounter(slow_populate)
+        laziest_dict = LaziestDict(populate)
+
+        self._run_threads(lambda: laziest_dict['foo'])
+        self.assertEqual(populate.counter, 1)
+        self.assertEqual(laziest_dict['foo'], 'foofoo')
+        self.assertEqual(laziest_dict._locks, {})
+
+    def test_laziest_concurrent_failures(self):
+        running = []
+        overlaps = []
+
+        def failing_populate(key):
+            running.append(key)
+            overlaps.append(len(running))
+            time.sleep(0.01)
+            running.pop()
+            raise ValueError(key)
+
+        laziest_dict = LaziestDict(failing_populate)
+
+        def read():
+            for dummy in range(5):
+                laziest_dict.get('foo')
+
+        self._run_threads(read)
+        self.assertEqual(max(overlaps), 1)
+        self.assertEqual(laziest_dict._locks, {})
+
+    def test_laziest_preload(self):
+        populate = CallCounter(lambda k: {'foo': 'bar', 1: 11}[k])
+        laziest_dict = LaziestDict(populate)
+
+        self.assertEqual(laziest_dict.preload(['foo', 1, 'missing'],
+                                              workers=2), ['missing'])
+        self.assertEqual(sorted(laziest_dict.keys(), key=str), [1, 'foo'])
+        self.assertEqual(laziest_dict[1], 11)
+        self.assertEqual(populate.counter, 3)
+        self.assertEqual(laziest_dict.preload([]), [])
+
+    def test_lazy_ttl(self):
+        now = [0]
+        invalidated = []
+        populate = CallCounter(lambda: {'foo': 'bar'})
+        lazy_dict = LazyDict(populate, ttl=10, timer=lambda: now[0],
+                             on_invalidate=invalidated.append)
+
+        self.assertEqual(lazy_dict['foo'], 'bar')
+        now[0] = 5
+        self.assertEqual(lazy_dict['foo'], 'bar')
+        self.assertEqual(populate.counter, 1)
+        now[0] = 10
+        self.assertEqual(lazy_dict['foo'], 'bar')
+        self.assertEqual(populate.counter, 2)
+        self.assertEqual(invalidated, [None])
+
+    def test_laziest_ttl_and_maxsize(self):
+        now = [0]
+        invalidated = []
+        populate = CallCounter(lambda k: k * 2)
+        laziest_dict = LaziestDict(populate, ttl=10, maxsize=2,
+                                   timer=lambda: now[0],
+                                   on_invalidate=invalidated.append)
+
+        laziest_dict['a']
+        laziest_dict['b']
+        laziest_dict['a']
+        laziest_dict['c']
+        self.assertEqual(sorted(laziest_dict.keys()), ['a', 'c'])
+        self.assertEqual(invalidated, ['b'])
+        self.assertEqual(populate.counter, 3)
+
+        now[0] = 10
+        self.assertEqual(laziest_dict['a'], 'aa')
+        self.assertEqual(populate.counter, 4)
+        self.assertEqual(laziest_dict.purge(), ['c'])
+        self.assertEqual(invalidated, ['b', 'a', 'c'])
+
+        laziest_dict.invalidate('a')
+        self.assertEqual(list(laziest_dict.keys()), [])
+        self.assertEqual(invalidated, ['b', 'a', 'c', 'a'])
+
+    def test_laziest_negative_ttl(self):
+        now = [0]
+        populate = CallCounter(lambda k: {'foo': 'bar'}[k])
+        laziest_dict = LaziestDict(populate, negative_ttl=5,
+                                   timer=lambda: now[0])
+
+        self.assertFalse('missing' in laziest_dict)
+        self.assertRaises(KeyError, lambda: laziest_dict['missing'])
+        self.assertEqual(populate.counter, 1)
+
+        now[0] = 5
+        self.assertFalse('missing' in laziest_dict)
+        self.assertEqual(populate.counter, 2)
+
+        laziest_dict.invalidate('missing')
+        self.assertFalse('missing' in laziest_dict)
+        self.assertEqual(populate.counter, 3)
+
+        for key in range(100):
+            now[0] += 1
+            self.assertFalse(key in laziest_dict)
+        self.assertTrue(len(laziest_dict._failures) <= 5)
+
+    def test_laziest_concurrent_eviction(self):
+        laziest_dict = LaziestDict(lambda k: k, maxsize=1)
+        errors = []
+
+        def read(key):
+            for dummy in range(2000):
+                try:
+                    laziest_dict[key]
+                except KeyError as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=read, args=(key, ))
+                   for key in 'ab']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
 
 class TestSmartDict(InvenioTestCase):
 
@@ -382,6 +532,159 @@ class TestSmartDict(InvenioTestCase):
 
         self.assertTrue(d == d3)
 
+    def test_smart_compiled_keys(self):
+        from invenio_utils.datastructures import _compile_key
+        key = 'a[0].b'
+        self.assertIs(_compile_key(key), _compile_key(key))
+
+        d = SmartDict({'a': [{'b': 1, 'c': [1, 2]}, {'b': 2}, 'x'],
+                       'd': {'0]': 'raw'}})
+        self.assertEqual(d['a[0].b'], 1)
+        self.assertEqual(d['a[1].b'], 2)
+        self.assertEqual(d['a[n]'], 'x')
+        self.assertEqual(d['a[0].c[1:]'], [2])
+        self.assertEqual(d['a.b'], [1, 2])
+        self.assertEqual(d['a.missing'], [])
+        self.assertEqual(d['d[0]'], 'raw')
+        self.assertEqual(d['a.c.x'], [])
+        self.assertRaises(KeyError, lambda: d['x.y'])
+        self.assertRaises(ValueError, lambda: d['a[x]'])
+
+    def test_query_records(self):
+        records = [
+            SmartDict({'title': {'title': 'A'},
+                       'authors': [{'full_name': 'x'}, {'full_name': 'y'}]}),
+            {'title': {'title': 'B'}, 'authors': []},
+            {'authors': [{'affiliation': 'CERN'}]},
+        ]
+        keys = ['title.title', 'authors.full_name', 'authors']
+        columns = query_records(keys, iter(records), default='-')
+
+        self.assertEqual(columns[0], ['A', 'B', '-'])
+        self.assertEqual(columns[1], [['x', 'y'], [], []])
+        self.assertEqual(columns[2], [records[0]['authors'], [],
+                                      [{'affiliation': 'CERN'}]])
+        self.assertEqual(query_records(['authors[0].full_name'], records),
+                         [['x', None, None]])
+        records.append({'title': None, 'authors': None})
+        self.assertEqual(query_records(['title.title', 'authors[0]'],
+                                       records, default='-'),
+                         [['A', 'B', '-', '-'],
+                          [{'full_name': 'x'}, '-', {'affiliation': 'CERN'},
+                           '-']])
+
+    def test_smart_pickle(self):
+        d = SmartDict({'a': [{'b': 1}]})
+        d.extra = 'x'
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            restored = pickle.loads(pickle.dumps(d, protocol))
+            self.assertEqual(restored, d)
+            self.assertEqual(restored.extra, 'x')
+
+    def test_smart_changes(self):
+        d = SmartDict({'a': {'b': 1}, 'c': [1]}, track_changes=True)
+        self.assertEqual(d.changes(), frozenset())
+
+        d['a.b'] = 2
+        d.set('c', 2, extend=True)
+        del d['a']
+        d.update({'e': 3}, f=4)
+        self.assertEqual(d.changes(clear=True),
+                         frozenset(['a.b', 'c', 'a', 'e', 'f']))
+        self.assertEqual(d.changes(), frozenset())
+        self.assertEqual(d['c'], [1, 2])
+
+        restored = pickle.loads(pickle.dumps(d))
+        restored['g'] = 5
+        self.assertEqual(restored.changes(), frozenset(['g']))
+
+        self.assertRaises(RuntimeError, SmartDict().changes)
+
+
+class TestCompactDict(InvenioTestCase):
+
+    def test_compact_dict(self):
+        a = CompactDict({'title': 'A', 'year': 2015})
+        b = CompactDict(title='B', year=2014)
+
+        self.assertIs(a._table, b._table)
+        self.assertEqual(a, {'title': 'A', 'year': 2015})
+        self.assertFalse(hasattr(a, '__dict__'))
+        self.assertTrue(isinstance(a, MutableMapping))
+        self.assertEqual(a.get('missing', 0), 0)
+        self.assertEqual(len(b), 2)
+        self.assertTrue('year' in b)
+        self.assertRaises(KeyError, lambda: a['missing'])
+
+        a['year'] = 2016
+        self.assertIs(a._table, b._table)
+        a['volume'] = 3
+        self.assertIsNot(a._table, b._table)
+        del a['volume']
+        self.assertIs(a._table, b._table)
+        self.assertEqual(dict(a), {'title': 'A', 'year': 2016})
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            restored = pickle.loads(pickle.dumps(a, protocol))
+            self.assertEqual(restored, a)
+            self.assertIs(restored._table, b._table)
+
+    def test_compact_smart_dict(self):
+        records = [compact({'title': {'title': t},
+                            'authors': [{'full_name': t.lower()}]})
+                   for t in 'AB']
+        self.assertIs(records[0]['authors'][0]._table,
+                      records[1]['authors'][0]._table)
+
+        d = SmartDict(records[0])
+        self.assertEqual(d['title.title'], 'A')
+        self.assertEqual(d['authors.full_name'], ['a'])
+        self.assertEqual(d['authors[0].full_name'], 'a')
+        d['title.subtitle'] = 'S'
+        self.assertEqual(d['title'], {'title': 'A', 'subtitle': 'S'})
+        self.assertEqual(query_records(['title.title'], records),
+                         [['A', 'B']])
+
+
+class TestPersistentSmartDict(InvenioTestCase):
+
+    def test_set(self):
+        v1 = PersistentSmartDict({'a': [{'b': 1}, {'b': 2}], 'c': {'d': 2}})
+        v2 = v1.set('a[0].b', 3)
+
+        self.assertEqual(v1['a.b'], [1, 2])
+        self.assertEqual(v2['a.b'], [3, 2])
+        self.assertIs(v1['c'], v2['c'])
+        self.assertIs(v1['a[1]'], v2['a[1]'])
+        self.assertRaises(TypeError, setitem, v2, 'c', 1)
+        self.assertRaises(TypeError, delitem, v2, 'c')
+
+        v3 = v2.set('a', {'b': 4}, extend=True).set('c.e', 5)
+        self.assertEqual(v3['a.b'], [3, 2, 4])
+        self.assertEqual(v3['c'], {'d': 2, 'e': 5})
+        self.assertEqual(v2['a.b'], [3, 2])
+        self.assertEqual(v2['c'], {'d': 2})
+
+        v4 = v3.delete('c').update({'f': 6})
+        self.assertEqual(sorted(v4.keys()), ['a', 'f'])
+        self.assertTrue('c' in v3)
+
+    def test_set_compact(self):
+        v1 = PersistentSmartDict(compact({'a': {'b': 1}, 'c': {'d': 2}}))
+        v2 = v1.set('a.b', 3)
+        self.assertEqual((v1['a.b'], v2['a.b']), (1, 3))
+        self.assertIs(v1['c'], v2['c'])
+
+    def test_diff(self):
+        v1 = PersistentSmartDict({'a': [{'b': 1}, {'b': 2}], 'c': {'d': 2}})
+        v2 = v1.set('a[1].b', 3).set('c.e', 4).set('f', 5)
+
+        self.assertEqual(v1.diff(v1), set())
+        self.assertEqual(v1.diff(v2), set(['a[1].b', 'c.e', 'f']))
+        self.assertEqual(v1.diff(v2.set('a', [1])), set(['a', 'c.e', 'f']))
+        self.assertEqual(v1.diff(SmartDict({'a': [{'b': 1}, {'b': 2}],
+                                            'c': {'d': 2}})), set())
+
 
 class TestDotableDict(InvenioTestCase):
 
@@ -402,3 +705,25 @@ class TestFlattenMultict(InvenioTestCase):
         d2 = flatten_multidict(d)
 
         self.assertEqual(d2, {'a': 3, 'b': {'c': 5}})
+
+    def test_flatten_multidict_lists(self):
+        d = MultiDict([('a', 1), ('a', 2), ('b', 3)])
+
+        self.assertEqual(flatten_multidict(d), {'a': [1, 2], 'b': 3})
+
+    def test_iter_flattened(self):
+        d = MultiDict([('a', 1), ('a', 2), ('b', 3)])
+        pairs = iter_flattened(d)
+
+        self.assertFalse(isinstance(pairs, (list, dict)))
+        self.assertEqual(sorted(pairs), [('a', [1, 2]), ('b', 3)])
+        self.assertEqual(dict(iter_flattened({'c': [], 'd': 'text'})),
+                         {'c': [], 'd': 'text'})
+
+    def test_flatten_dict_of_lists(self):
+        d = {'a': [1, 2], 'b': [3], 'c': [], 'd': 'text'}
+
+        self.assertEqual(flatten_multidict(d),
+                         {'a': [1, 2], 'b': 3, 'c': [], 'd': 'text'})
+        self.assertEqual(list(flatten_multidicts([d, {'e': [4]}])),
+                         [flatten_multidict(d), {'e': 4}])
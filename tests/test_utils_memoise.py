@@ -19,8 +19,20 @@
 
 """Unit tests for the memoise facility."""
 
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
 from invenio_testing import InvenioTestCase
 
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
 
 def fib(n):
     """Return Fibonacci number for 'n'."""
@@ -39,3 +51,422 @@ class MemoiseTest(InvenioTestCase):
         from invenio_utils.memoise import Memoise
         fib_memoised = Memoise(fib)
         self.assertEqual(fib(17), fib_memoised(17))
+
+    def test_memoise_cache_lru(self):
+        """memoiseutil - test least recently used entry eviction."""
+        from invenio_utils.memoise import MemoiseCache
+        cache = MemoiseCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_memoise_cache_ttl(self):
+        """memoiseutil - test expiration of cached entries."""
+        from invenio_utils.memoise import MemoiseCache
+        now = [0]
+        cache = MemoiseCache(ttl=10, timer=lambda: now[0])
+        cache['a'] = 1
+        now[0] = 5
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 10
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_memoize_bounded(self):
+        """memoiseutil - test bounded memoize decorator."""
+        from invenio_utils.memoise import memoize
+        calls = []
+
+        @memoize(maxsize=1)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(calls, [2, 3, 2])
+        self.assertEqual(len(square.cache), 1)
+
+    def test_make_key_normalises_arguments(self):
+        """memoiseutil - test cache keys follow the function signature."""
+        from invenio_utils.memoise import make_key
+
+        def func(a, b=2, *args, **kwargs):
+            pass
+
+        key = make_key(func)
+        self.assertEqual(key(1), key(1, 2))
+        self.assertEqual(key(1), key(a=1))
+        self.assertEqual(key(1), key(1, b=2))
+        self.assertNotEqual(key(1), key(1, 3))
+        self.assertEqual(key(1, c=3, d=4), key(1, d=4, c=3))
+        self.assertNotEqual(key(1, 2, 3), key(1, 2, c=3))
+
+    def test_make_key_unhashable_arguments(self):
+        """memoiseutil - test cache keys for unhashable arguments."""
+        from invenio_utils.memoise import make_key
+
+        class Record(object):
+            __hash__ = None
+
+            def __init__(self, recid):
+                self.recid = recid
+
+        def func(a, b=None):
+            pass
+
+        key = make_key(func, key_functions={Record: lambda r: r.recid})
+        self.assertEqual(key([1, {'a': [2]}]), key([1, {'a': [2]}]))
+        self.assertNotEqual(key([1, 2]), key((1, 2)))
+        self.assertEqual(key(Record(1), b=[Record(2)]),
+                         key(Record(1), [Record(2)]))
+        self.assertRaises(TypeError, make_key(func), Record(1))
+
+    def test_make_key_typed(self):
+        """memoiseutil - test argument types are part of cache keys."""
+        from invenio_utils.memoise import make_key, memoize
+
+        def func(a, b=None):
+            pass
+
+        key = make_key(func)
+        self.assertEqual(len(set([key(1), key(True), key(1.0)])), 3)
+        self.assertNotEqual(key(b'a'), key(u'a'))
+        self.assertNotEqual(key(1, b=1), key(1, b=True))
+        self.assertEqual(make_key(func, typed=False)(1),
+                         make_key(func, typed=False)(True))
+
+        type_name = memoize(lambda x: type(x).__name__)
+        self.assertEqual([type_name(value) for value in (1, True, 1.0)],
+                         ['int', 'bool', 'float'])
+
+    def test_make_key_deterministic(self):
+        """memoiseutil - test frozen mappings and sets are ordered."""
+        from invenio_utils.memoise import freeze
+        self.assertEqual(freeze({'b': 1, 'a': [2]}),
+                         freeze(dict([('a', [2]), ('b', 1)])))
+        self.assertEqual(freeze(set([3, 1, 2]))[1], (1, 2, 3))
+        self.assertEqual(freeze({1: 'a', 'b': 2}), freeze({'b': 2, 1: 'a'}))
+
+    def test_memoize_keyword_arguments(self):
+        """memoiseutil - test memoize shares entries across call styles."""
+        from invenio_utils.memoise import memoize
+        calls = []
+
+        @memoize
+        def power(x, exp=2):
+            calls.append(x)
+            return x ** exp
+
+        self.assertEqual(power(3), 9)
+        self.assertEqual(power(x=3), 9)
+        self.assertEqual(power(3, exp=2), 9)
+        self.assertEqual(power([3][0], 2), 9)
+        self.assertEqual(calls, [3])
+
+    def test_memoize_single_flight(self):
+        """memoiseutil - test concurrent misses compute the value once."""
+        from invenio_utils.memoise import memoize
+        calls = []
+        results = []
+
+        @memoize
+        def slow_square(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return x * x
+
+        threads = [threading.Thread(target=lambda: results.append(
+            slow_square(3))) for dummy in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [3])
+        self.assertEqual(results, [9] * 5)
+
+    def test_single_flight_shares_errors(self):
+        """memoiseutil - test failed computations are not cached."""
+        from invenio_utils.memoise import memoize
+        calls = []
+
+        @memoize
+        def fail(x):
+            calls.append(x)
+            raise ValueError(x)
+
+        self.assertRaises(ValueError, fail, 1)
+        self.assertRaises(ValueError, fail, 1)
+        self.assertEqual(calls, [1, 1])
+
+    def test_single_flight_shares_base_exceptions(self):
+        """memoiseutil - test waiters see an aborted owner's exception."""
+        from invenio_utils.memoise import SingleFlight
+        flight = SingleFlight()
+        started = threading.Event()
+        results = []
+
+        def abort():
+            started.set()
+            time.sleep(0.05)
+            raise KeyboardInterrupt()
+
+        def owner():
+            try:
+                flight.do('key', abort)
+            except KeyboardInterrupt:
+                results.append('owner aborted')
+
+        def waiter():
+            started.wait()
+            try:
+                results.append(('waiter got', flight.do('key', abort)))
+            except KeyboardInterrupt:
+                results.append('waiter aborted')
+
+        threads = [threading.Thread(target=owner),
+                   threading.Thread(target=waiter)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), ['owner aborted', 'waiter aborted'])
+
+    def test_memoize_rechecks_cache_in_flight(self):
+        """memoiseutil - test a late miss reuses the stored value."""
+        from invenio_utils.memoise import memoize
+        calls = []
+
+        @memoize
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        square(3)
+        # Simulate a caller which missed just before the value was stored.
+        value = square.cache.get(square.cache_key(4))
+        self.assertEqual(value, None)
+        square.cache[square.cache_key(4)] = 16
+        self.assertEqual(square(4), 16)
+        self.assertEqual(calls, [3])
+
+    @unittest.skipIf(asyncio is None, 'asyncio is not available')
+    def test_memoize_async(self):
+        """memoiseutil - test memoisation of coroutine functions."""
+        from invenio_utils.memoise import memoize_async
+        calls = []
+
+        @memoize_async
+        def slow_square(x):
+            calls.append(x)
+            return asyncio.sleep(0.01, result=x * x)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(asyncio.gather(
+                slow_square(3), slow_square(3), slow_square(4)))
+            self.assertEqual(results, [9, 9, 16])
+            self.assertEqual(
+                loop.run_until_complete(slow_square(3)), 9)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(calls, [3, 4])
+
+    @unittest.skipIf(asyncio is None, 'asyncio is not available')
+    def test_memoize_async_several_loops(self):
+        """memoiseutil - test memoize_async used from several loops."""
+        from invenio_utils.memoise import memoize_async
+        calls = []
+
+        @memoize_async
+        def slow_square(x):
+            calls.append(x)
+            return asyncio.sleep(0.01, result=x * x)
+
+        def run(coroutine_factory):
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                return loop.run_until_complete(coroutine_factory())
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(run(
+            lambda: asyncio.gather(slow_square(5), slow_square(5)))))
+            for dummy in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[25, 25], [25, 25]])
+        self.assertEqual(run(lambda: slow_square(5)), 25)
+        self.assertTrue(len(calls) <= 2)
+
+    def test_cache_introspection(self):
+        """memoiseutil - test cache_info, cache_evict and cache_clear."""
+        from invenio_utils.memoise import Memoise, memoize
+
+        @memoize(maxsize=10)
+        def power(x, exp=2):
+            return x ** exp
+
+        power(2)
+        power(2, exp=2)
+        power(3)
+        info = power.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize,
+                          info.maxsize), (1, 2, 2, 10))
+        self.assertTrue(info.nbytes > 0)
+        self.assertTrue(power.cache.age(power.cache_key(2)) >= 0)
+        self.assertTrue(power.cache_evict(x=2))
+        self.assertFalse(power.cache_evict(2))
+        self.assertEqual(power.cache_info().currsize, 1)
+        power.cache_clear()
+        self.assertEqual(power.cache_info().currsize, 0)
+
+        fib_memoised = Memoise(fib)
+        fib_memoised(5)
+        self.assertTrue(fib_memoised.cache_evict(5))
+        self.assertEqual(fib_memoised.cache_info().currsize, 0)
+
+    def test_plain_mapping_cache(self):
+        """memoiseutil - test memoising into a plain dictionary."""
+        from invenio_utils.memoise import Memoise, memoise_report, memoize
+        cache = {}
+        square = memoize(lambda x: x * x, cache=cache)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(list(cache.values()), [9])
+        info = square.cache_info()
+        self.assertEqual((info.hits, info.currsize, info.nbytes),
+                         (None, 1, None))
+        self.assertTrue(square.cache_evict(3))
+        square(4)
+        square.cache_clear()
+        self.assertEqual(cache, {})
+
+        fib_memoised = Memoise(fib, cache={})
+        self.assertEqual(fib_memoised(5), 8)
+        self.assertEqual(fib_memoised.cache_info().currsize, 1)
+        memoise_report()
+
+    def test_memoise_report(self):
+        """memoiseutil - test listing of memoised functions."""
+        from invenio_utils.memoise import memoise_report, memoize
+
+        @memoize
+        def identity(x):
+            return x
+
+        identity('x' * 1000)
+        report = [item for item in memoise_report()
+                  if item['name'] == __name__ + '.identity']
+        self.assertEqual(len(report), 1)
+        self.assertEqual(report[0]['currsize'], 1)
+        self.assertTrue(report[0]['nbytes'] > 1000)
+
+
+class FileSystemCacheTest(InvenioTestCase):
+
+    """Unit test cases for FileSystemCache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_entries(self):
+        """memoiseutil - test entries are shared between cache instances."""
+        from invenio_utils.memoise import FileSystemCache
+        cache = FileSystemCache(self.directory)
+        cache[('a', 1)] = {'title': [u'F\xf6\xf6']}
+        other = FileSystemCache(self.directory)
+        self.assertEqual(other[('a', 1)], {'title': [u'F\xf6\xf6']})
+        self.assertTrue(('a', 1) in other)
+        self.assertFalse(('a', 2) in other)
+        del other[('a', 1)]
+        self.assertEqual(cache.get(('a', 1)), None)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_maxsize_and_ttl(self):
+        """memoiseutil - test bounded and expiring file cache."""
+        from invenio_utils.memoise import FileSystemCache
+        cache = FileSystemCache(self.directory, maxsize=2)
+        for i in range(4):
+            cache[i] = i
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+        now = [time.time()]
+        cache = FileSystemCache(self.directory, ttl=10, timer=lambda: now[0])
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        now[0] += 10
+        self.assertRaises(KeyError, lambda: cache['a'])
+
+    def test_prune_lists_directory_only_when_full(self):
+        """memoiseutil - test writes below maxsize do not list entries."""
+        from invenio_utils.memoise import FileSystemCache
+        cache = FileSystemCache(self.directory, maxsize=3)
+        cache['a'] = 1
+        listed = []
+        entries = cache._entries
+        cache._entries = lambda: listed.append(1) or entries()
+        cache['b'] = 2
+        cache['c'] = 3
+        cache['c'] = 3
+        self.assertEqual(listed, [])
+        cache['d'] = 4
+        self.assertEqual(listed, [1])
+        self.assertEqual(len(cache), 3)
+
+    def test_corrupted_entry_is_a_miss(self):
+        """memoiseutil - test truncated entries are removed and recomputed."""
+        from invenio_utils.memoise import FileSystemCache, memoize
+        cache = FileSystemCache(self.directory)
+        calls = []
+
+        @memoize(cache=cache)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        self.assertEqual(square(3), 9)
+        path = cache._path(square.cache_key(3))
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        self.assertEqual(cache.get(square.cache_key(3)), None)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(square(3), 9)
+        self.assertEqual(calls, [3, 3])
+
+    def test_memoize_with_file_cache(self):
+        """memoiseutil - test memoize backed by a file cache."""
+        from invenio_utils.memoise import FileSystemCache, memoize
+        calls = []
+
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        first = memoize(square, cache=FileSystemCache(self.directory))
+        second = memoize(square, cache=FileSystemCache(self.directory))
+        self.assertEqual(first(3), 9)
+        self.assertEqual(second(3), 9)
+        self.assertEqual(calls, [3])
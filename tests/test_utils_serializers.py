@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the serializers."""
+
+import multiprocessing
+import unittest
+from io import BytesIO
+
+from invenio_testing import InvenioTestCase
+from invenio_utils.serializers import LzmaPickle, SerializerError, \
+    ZlibPickle
+
+RECORD = {
+    'recid': 1,
+    'title': {'title': u'Stra\xdfe'},
+    'authors': [{'full_name': u'Ellis, J.%d' % i} for i in range(2000)],
+}
+
+
+class StreamingSerializersTest(InvenioTestCase):
+
+    """Test streaming dump/load of compressed pickles."""
+
+    def test_zlib_pickle_stream(self):
+        """serializers - test ZlibPickle dump and load."""
+        stream = BytesIO()
+        ZlibPickle.dump(RECORD, stream, chunk_size=1024)
+        self.assertEqual(ZlibPickle.loads(stream.getvalue()), RECORD)
+        stream.seek(0)
+        self.assertEqual(ZlibPickle.load(stream, chunk_size=128), RECORD)
+        stream = BytesIO(ZlibPickle.dumps(RECORD))
+        self.assertEqual(ZlibPickle.load(stream), RECORD)
+
+    def test_lzma_pickle_stream(self):
+        """serializers - test LzmaPickle dump and load."""
+        stream = BytesIO()
+        LzmaPickle.dump(RECORD, stream, chunk_size=1024)
+        self.assertEqual(LzmaPickle.loads(stream.getvalue()), RECORD)
+        stream.seek(0)
+        self.assertEqual(LzmaPickle.load(stream, chunk_size=128), RECORD)
+
+    def test_truncated_stream(self):
+        """serializers - test loading a truncated stream."""
+        blob = ZlibPickle.dumps(RECORD)
+        self.assertRaises(SerializerError, ZlibPickle.load,
+                          BytesIO(blob[:len(blob) // 2]))
+
+
+class SerializerRegistryTest(InvenioTestCase):
+
+    """Test combinations of registered serializers and codecs."""
+
+    def test_combinations(self):
+        """serializers - test all serializer and codec combinations."""
+        from invenio_utils.serializers import Serializer
+        record = {'recid': 1, 'title': u'Stra\xdfe', 'tags': [1, 2.5, None]}
+        for serializer in ('marshal', 'pickle', 'json'):
+            reader = Serializer(serializer, 'none')
+            for codec in ('none', 'zlib', 'lzma', 'bz2'):
+                blob = Serializer(serializer, codec, level=1).dumps(record)
+                self.assertEqual(reader.loads(blob), record)
+                stream = BytesIO()
+                Serializer(serializer, codec).dump(record, stream)
+                stream.seek(0)
+                self.assertEqual(reader.load(stream), record)
+
+    def test_legacy_compatibility(self):
+        """serializers - test reading blobs with and without header."""
+        from invenio_utils.serializers import Serializer, ZlibMarshal
+        legacy = ZlibPickle.dumps(RECORD)
+        self.assertEqual(Serializer('pickle', 'zlib').loads(legacy), RECORD)
+        self.assertEqual(Serializer('pickle', 'zlib').load(BytesIO(legacy)),
+                         RECORD)
+        self.assertRaises(SerializerError,
+                          Serializer('pickle', 'lzma').loads, legacy)
+        blob = Serializer('marshal', 'bz2').dumps(RECORD)
+        self.assertEqual(ZlibMarshal.loads(blob), RECORD)
+        headerless = Serializer('pickle', 'lzma', header=False).dumps(RECORD)
+        self.assertEqual(LzmaPickle.loads(headerless), RECORD)
+        blob = Serializer('pickle', 'bz2').dumps(RECORD)
+        self.assertEqual(LzmaPickle.loads(blob), RECORD)
+        for serializer in (ZlibPickle, LzmaPickle):
+            self.assertEqual(serializer.load(BytesIO(blob)), RECORD)
+
+    def test_accepted_formats(self):
+        """serializers - test readers only restore accepted formats."""
+        from six.moves import cPickle as pickle
+        from invenio_utils.serializers import Serializer, ZlibMarshal
+        pickled = Serializer('pickle', 'zlib').dumps(RECORD)
+        for reader in (ZlibMarshal, Serializer('marshal'), Serializer('json'),
+                       Serializer('json', accept=['marshal'])):
+            self.assertRaises(SerializerError, reader.loads, pickled)
+        self.assertRaises(SerializerError, Serializer('json').load,
+                          BytesIO(pickled))
+        marshalled = Serializer('marshal', 'lzma').dumps(RECORD)
+        for serializer in (ZlibPickle, LzmaPickle):
+            self.assertRaises(SerializerError, serializer.loads, marshalled)
+            self.assertRaises(SerializerError, serializer.load,
+                              BytesIO(marshalled))
+        reader = Serializer('json', accept=['marshal'])
+        self.assertEqual(reader.loads(marshalled), RECORD)
+        self.assertEqual(pickle.loads(pickle.dumps(reader)).loads(marshalled),
+                         RECORD)
+        self.assertRaises(SerializerError, Serializer, accept=['yaml'])
+
+    def test_unknown_names(self):
+        """serializers - test errors for unknown serializers and codecs."""
+        from invenio_utils.serializers import MAGIC, Serializer
+        self.assertRaises(SerializerError, Serializer, 'yaml')
+        self.assertRaises(SerializerError, Serializer, 'pickle', 'snappy')
+        self.assertRaises(SerializerError, Serializer().loads,
+                          MAGIC + b'\x01\x02\xff\x00data')
+        self.assertRaises(SerializerError, Serializer().loads, MAGIC + b'\x01')
+
+
+class PickleProtocolTest(InvenioTestCase):
+
+    """Test pickle protocols and buffer support."""
+
+    def test_highest_protocol(self):
+        """serializers - test pickles use the highest protocol by default."""
+        import zlib
+        from six.moves import cPickle as pickle
+        data = zlib.decompress(ZlibPickle.dumps(RECORD))
+        self.assertEqual(data[:2], b'\x80' + bytes(bytearray(
+            [pickle.HIGHEST_PROTOCOL])))
+        self.assertTrue(len(ZlibPickle.dumps(RECORD)) <
+                        len(ZlibPickle.dumps(RECORD, protocol=0)))
+
+    def test_protocol_zero_blobs(self):
+        """serializers - test loading existing protocol 0 blobs."""
+        from invenio_utils.serializers import Serializer
+        blob = ZlibPickle.dumps(RECORD, protocol=0)
+        self.assertEqual(ZlibPickle.loads(blob), RECORD)
+        self.assertEqual(Serializer().loads(blob), RECORD)
+        stream = BytesIO()
+        LzmaPickle.dump(RECORD, stream, protocol=0)
+        self.assertEqual(LzmaPickle.loads(stream.getvalue()), RECORD)
+
+    def test_buffers(self):
+        """serializers - test bytearray and memoryview input and output."""
+        from invenio_utils.serializers import Serializer, ZlibMarshal
+        for codec in ('none', 'zlib', 'lzma', 'bz2'):
+            serializer = Serializer('pickle', codec)
+            out = bytearray(b'prefix')
+            self.assertTrue(serializer.dumps(RECORD, into=out) is out)
+            view = memoryview(out)[len(b'prefix'):]
+            self.assertEqual(serializer.loads(view), RECORD)
+            self.assertEqual(serializer.loads(bytearray(view)), RECORD)
+        blob = ZlibMarshal.dumps(RECORD)
+        self.assertEqual(ZlibMarshal.loads(bytearray(blob)), RECORD)
+        self.assertEqual(ZlibPickle.loads(
+            memoryview(ZlibPickle.dumps(RECORD))), RECORD)
+        self.assertEqual(LzmaPickle.loads(
+            bytearray(LzmaPickle.dumps(RECORD))), RECORD)
+
+
+class PresetDictionaryTest(InvenioTestCase):
+
+    """Test dictionary-trained compression."""
+
+    @staticmethod
+    def records():
+        return [{'recid': i, 'control_number': str(i),
+                 'titles': [{'title': u'Measurement of %d things' % i}],
+                 'authors': [{'full_name': u'Author, %d.' % i,
+                              'affiliations': [{'value': u'CERN'}]}]}
+                for i in range(200)]
+
+    def test_train_and_compress(self):
+        """serializers - test small blobs compress better with dictionary."""
+        from six.moves import cPickle as pickle
+        from invenio_utils.serializers import Serializer, train_dictionary
+        records = self.records()
+        zdict = train_dictionary(pickle.dumps(r, 2) for r in records[:100])
+        self.assertTrue(0 < len(zdict) <= 32 * 1024)
+        plain = Serializer('pickle', 'zlib', protocol=2)
+        trained = Serializer('pickle', 'zlib', protocol=2, dictionary=zdict)
+        plain_size = trained_size = 0
+        for record in records[100:]:
+            blob = trained.dumps(record)
+            self.assertEqual(Serializer().loads(blob), record)
+            stream = BytesIO()
+            trained.dump(record, stream)
+            stream.seek(0)
+            self.assertEqual(Serializer().load(stream), record)
+            plain_size += len(plain.dumps(record))
+            trained_size += len(blob)
+        self.assertTrue(trained_size < plain_size * 0.8)
+
+    def test_unknown_dictionary(self):
+        """serializers - test dictionary id is checked when loading."""
+        from invenio_utils.serializers import MAGIC, Serializer
+        blob = Serializer(dictionary=b'unregistered dictionary').dumps(1)
+        broken = blob[:len(MAGIC) + 4] + b'\x00\x00\x00\x00' + \
+            blob[len(MAGIC) + 8:]
+        self.assertRaises(SerializerError, Serializer().loads, broken)
+        self.assertRaises(SerializerError, Serializer, 'pickle', 'lzma',
+                          dictionary=b'dictionary')
+
+
+class BatchSerializersTest(InvenioTestCase):
+
+    """Test batch serialization in thread and process pools."""
+
+    def test_threads(self):
+        """serializers - test dumps_many and loads_many with threads."""
+        from invenio_utils.serializers import Serializer, ZlibMarshal, \
+            dumps_many, loads_many
+        records = [{'recid': i, 'title': u'Title %d' % i} for i in range(100)]
+        for serializer in (ZlibPickle, ZlibMarshal, Serializer('json')):
+            blobs = list(dumps_many(records, serializer, workers=3,
+                                    chunksize=2))
+            self.assertEqual(blobs, [serializer.dumps(r) for r in records])
+            self.assertEqual(
+                list(loads_many(iter(blobs), serializer, workers=3)),
+                records)
+
+    def test_processes(self):
+        """serializers - test dumps_many and loads_many with processes."""
+        from invenio_utils.serializers import Serializer, dumps_many, \
+            loads_many
+        records = [{'recid': i} for i in range(20)]
+        serializer = Serializer('pickle', 'zlib', dictionary=b'recid')
+        blobs = list(dumps_many(records, serializer, workers=2,
+                                processes=True))
+        self.assertEqual(list(loads_many(blobs, workers=2, processes=True)),
+                         records)
+
+    @unittest.skipIf(not hasattr(multiprocessing, 'get_context'),
+                     'start methods are not available')
+    def test_spawned_processes(self):
+        """serializers - test dictionaries are sent to spawned processes."""
+        from invenio_utils.serializers import Serializer, dumps_many, \
+            loads_many
+        records = [{'recid': i} for i in range(20)]
+        context = multiprocessing.get_context('spawn')
+        serializer = Serializer('pickle', 'zlib', dictionary=b'spawn recid')
+        blobs = list(dumps_many(records, serializer, workers=2,
+                                processes=context))
+        self.assertEqual(blobs, [serializer.dumps(r) for r in records])
+        self.assertEqual(list(loads_many(blobs, workers=2,
+                                         processes=context)), records)
+
+    def test_bounded_submission(self):
+        """serializers - test input is consumed a bounded amount ahead."""
+        from invenio_utils.serializers import dumps_many
+        consumed = []
+
+        def records():
+            for i in range(10000):
+                consumed.append(i)
+                yield i
+
+        results = dumps_many(records(), workers=2, chunksize=10)
+        self.assertEqual(ZlibPickle.loads(next(results)), 0)
+        self.assertTrue(len(consumed) <= 2 * 4 * 10 + 10)
+        self.assertEqual([ZlibPickle.loads(blob) for blob in results],
+                         list(range(1, 10000)))
+
+    def test_errors(self):
+        """serializers - test errors are raised by the generator."""
+        from invenio_utils.serializers import loads_many
+        results = loads_many([ZlibPickle.dumps(1), b'broken'], workers=2)
+        self.assertRaises(SerializerError, list, results)
@@ -39,7 +39,10 @@ guess_minimum_encoding = lazy_import('invenio_utils.text:guess_minimum_encoding'
 show_diff = lazy_import('invenio_utils.text:show_diff')
 strip_accents = lazy_import('invenio_utils.text:strip_accents')
 translate_latex2unicode = lazy_import('invenio_utils.text:translate_latex2unicode')
+translate_latex2unicode_many = lazy_import('invenio_utils.text:translate_latex2unicode_many')
 translate_to_ascii = lazy_import('invenio_utils.text:translate_to_ascii')
+slugify = lazy_import('invenio_utils.text:slugify')
+slugify_many = lazy_import('invenio_utils.text:slugify_many')
 transliterate_ala_lc = lazy_import('invenio_utils.text:transliterate_ala_lc')
 wash_for_utf8 = lazy_import('invenio_utils.text:wash_for_utf8')
 wash_for_xml = lazy_import('invenio_utils.text:wash_for_xml')
@@ -434,6 +437,69 @@ class Latex2UnicodeTest(InvenioTestCase):
         self.assertEqual(translate_latex2unicode("\\AAkeson"), u'\u212bkeson')
         self.assertEqual(translate_latex2unicode("$\\mathsl{\\Zeta}$"), u'\U0001d6e7')
 
+    def test_latex_to_unicode_marker_symbols(self):
+        """textutils - latex_to_unicode prefers symbols including markers"""
+        self.assertEqual(translate_latex2unicode("$\\le$"), u'\u2264')
+        self.assertEqual(translate_latex2unicode("{\\AA}kesson"),
+                         u'\xc5kesson')
+        self.assertEqual(translate_latex2unicode("$\\mu$"), u'\xb5')
+
+    def test_latex_to_unicode_many_symbols(self):
+        """textutils - latex_to_unicode with repeated symbols and markers"""
+        self.assertEqual(translate_latex2unicode("{\\'e}$\\alpha$ " * 100),
+                         u'\xe9\u03b1 ' * 100)
+
+    def test_latex_to_unicode_many(self):
+        """textutils - latex_to_unicode on a batch of texts"""
+        texts = ["\\'a %d" % i for i in range(200)]
+        expected = [u'\xe1 %d' % i for i in range(200)]
+        self.assertEqual(list(translate_latex2unicode_many(texts)), expected)
+        self.assertEqual(list(translate_latex2unicode_many(
+            texts, workers=2, chunksize=8)), expected)
+        self.assertEqual(list(translate_latex2unicode_many([], workers=2)),
+                         [])
+
+    def test_latex_to_unicode_compiled_kb(self):
+        """textutils - latex_to_unicode KB cache checked before loading"""
+        import os
+        import shutil
+        import tempfile
+        from invenio_utils import text
+
+        tmpdir = tempfile.mkdtemp()
+        kb_file = os.path.join(tmpdir, 'test.kb')
+        try:
+            with open(kb_file, 'w') as kb:
+                kb.write('\\foo|--|F\n\\foobar|--|FB\n'
+                         '\\l|--|L\n$\\le$|--|LE\n')
+            text._load_latex2unicode_constants(kb_file)
+            self.assertEqual(os.listdir(tmpdir), ['test.kb'])
+            cache_file = text.compile_latex2unicode_kb(kb_file)
+            self.assertTrue(os.path.exists(cache_file))
+            text._load_latex2unicode_constants(kb_file)
+            self.assertEqual(translate_latex2unicode("{\\foobar} \\foo"),
+                             u'FB F')
+            self.assertEqual(translate_latex2unicode("$\\le$ \\le {\\l}"),
+                             u'LE Le L')
+
+            # A cache compiled by another Python version is ignored.
+            with open(cache_file, 'rb') as cache:
+                header, payload = cache.read().split(b'\n', 1)
+            with open(cache_file, 'wb') as cache:
+                cache.write(header.replace(b'.', b'.9', 1) + b'\n')
+                cache.write(payload.replace(b'FB', b'XX'))
+            text._load_latex2unicode_constants(kb_file)
+            self.assertEqual(translate_latex2unicode("\\foobar"), u'FB')
+
+            with open(kb_file, 'w') as kb:
+                kb.write('\\foo|--|G\n')
+            os.utime(kb_file, (0, 0))
+            text._load_latex2unicode_constants(kb_file)
+            self.assertEqual(translate_latex2unicode("\\foo"), u'G')
+        finally:
+            text.CFG_LATEX_UNICODE_TRANSLATION_CONST.clear()
+            shutil.rmtree(tmpdir)
+
 
 class TestStripping(InvenioTestCase):
     """Test for stripping functions like accents and control characters."""
@@ -450,6 +516,14 @@ class TestStripping(InvenioTestCase):
         self.assertEqual(translate_to_ascii([]), [])
         self.assertEqual(translate_to_ascii([None]), [None])
         self.assertEqual(translate_to_ascii("√"), [""])
+        self.assertEqual(translate_to_ascii(["[?] √ Øst", "Øst"]),
+                         ["[?]  Ost", "Ost"])
+
+    def test_slugify(self):
+        """textutils - slugify single texts and batches"""
+        self.assertEqual(slugify(u'Héllo, Wörld!'), u'hello-world')
+        self.assertEqual(slugify_many([u'Åge Øst', u'a/b'], delim=u'_'),
+                         [u'age_ost', u'a_b'])
 
     def test_strip_accents(self):
         """textutils - transliterate to ascii (basic)"""
@@ -462,6 +536,16 @@ class TestStripping(InvenioTestCase):
         self.assertEqual("OE",
                          strip_accents('Œ'))
 
+    def test_strip_accents_extended(self):
+        """textutils - strip accents beyond Latin-1 and LaTeX escapes"""
+        self.assertEqual("Dvorak Nguyen Lukasiewicz Ohm",
+                         strip_accents('Dvořák Nguyễn Łukasiewicz O\xcc\x88hm'))
+        self.assertEqual("Schrodinger y AE \\v{x}",
+                         strip_accents('Schr\\"{o}dinger \\\'y \\AE \\v{x}'))
+        self.assertEqual("ae ae AE AE o O Bjorn",
+                         strip_accents('ǣ ǽ Ǣ Ǽ ǿ Ǿ Bjǿrn'))
+
+
 class TestDiffering(InvenioTestCase):
     """Test for differing two strings."""
 